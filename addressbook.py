@@ -1,11 +1,20 @@
-from collections import UserDict
+from collections import UserDict, defaultdict
+import gc
 import os
-import pickle
-import json
+import threading
+import atexit
+from bisect import bisect_left, insort
+from itertools import islice
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, date, time
+from array import array
+from time import perf_counter
 
-import birthdays
+# pickle, json and birthdays are imported where they are used,
+# so the bot starts before they are loaded (see benchmark.py --imports)
+from search import NameIndex
+from rwlock import RWLock
+from metrics import Metrics
 
 
 class ErrorWithMsg(Exception):
@@ -15,6 +24,8 @@ class ErrorWithMsg(Exception):
 class Field(ABC):
     """Base class for record fields."""
 
+    __slots__ = ("__value",)
+
     def __init__(self, value=None):
         self.__value = None
         if not value is None:
@@ -23,6 +34,15 @@ class Field(ABC):
     def __str__(self):
         return self.value
 
+    def __getstate__(self):
+        return (self.__value,)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Fields pickled before __slots__ were added
+            state = (state["_Field__value"],)
+        (self.__value,) = state
+
     @property
     def value(self):
         return self.__value
@@ -40,6 +60,8 @@ class Field(ABC):
 class Name(Field):
     """Class for storing a contact's name. Mandatory field."""
 
+    __slots__ = ()
+
     def validate(self, name: str):
         name = name.strip()
         if type(name) is str:
@@ -50,149 +72,796 @@ class Name(Field):
 class Phone(Field):
     """Class for storing a phone number. Validates the format (10 digits)."""
 
+    __slots__ = ()
+
     def validate(self, number: str):
         number = number.strip()
         if len(number) == 10 and number.isdigit():
             return number
         raise ErrorWithMsg("Invalid phone number format (expecting 10 digits)")
 
+    @property
+    def number(self) -> int:
+        return int(self.value)
+
+    @staticmethod
+    def format(number: int) -> str:
+        return f"{number:010d}"
+
 
 class Birthday(Field):
     """Class for storing a birthday. Validates the format (expecting DD.MM.YYYY)."""
 
+    __slots__ = ()
+    FORMAT = "%d.%m.%Y"
+
+    def __str__(self):
+        return Birthday.format(self.value)
+
     def validate(self, birthday: str):
         birthday = birthday.strip()
         try:
-            datetime.strptime(birthday, "%d.%m.%Y")
+            # Fast path for the usual DD.MM.YYYY, strptime handles the rest
+            day, month, year = birthday.split(".")
+            if (
+                len(year) == 4
+                and 0 < len(month) <= 2
+                and 0 < len(day) <= 2
+                and (day + month + year).isdigit()
+            ):
+                return date(int(year), int(month), int(day))
+            return datetime.strptime(birthday, Birthday.FORMAT).date()
         except:
             raise ErrorWithMsg("Invalid birthday format (DD.MM.YYYY)")
-        return birthday
+
+    @staticmethod
+    def format(birthday: date) -> str:
+        return birthday.strftime(Birthday.FORMAT)
 
 
 class Record:
-    """Class for storing contact information, including name and a list of phones."""
+    """Class for storing contact information, including name and a list of phones.
+
+    Phones are stored as numbers in a packed array and the birthday as a date,
+    both are validated only once when they are set.
+    """
+
+    __slots__ = ("name", "phones", "birthday", "__book", "__weakref__")
 
     def __init__(self, name: str, phone: str = None):
+        self.__book = None
         self.name = Name(name)
-        self.phones = []
-        self.birthday = Birthday()
+        self.phones = array("Q")
+        self.birthday = None
         if phone:
             self.add_phone(phone)
 
     def __str__(self):
-        text = f"Contact name: {self.get_name()}, phones: {'; '.join(p.value for p in self.phones)}"
-        if self.birthday.value:
-            text += f", birthday: {self.birthday.value}"
+        text = f"Contact name: {self.get_name()}, phones: {'; '.join(self.get_phones())}"
+        if self.birthday:
+            text += f", birthday: {self.show_birthday()}"
         return text
 
+    def __getstate__(self):
+        # The owning book is not a part of the record
+        return (self.name.value, self.phones, self.birthday)
+
+    def __setstate__(self, state):
+        self.__book = None
+        if isinstance(state, dict):
+            # Records pickled before __slots__ were added
+            self.name = state["name"]
+            self.phones = array("Q", (p.number for p in state["phones"]))
+            birthday = state["birthday"].value
+            self.birthday = Birthday(birthday).value if birthday else None
+            return
+        name, self.phones, self.birthday = state
+        self.name = Name(name)
+
+    @classmethod
+    def from_dict(cls, row: dict):
+        """Create a record from a dict with name, phones and birthday keys."""
+        phones = row.get("phones") or []
+        if type(phones) is str:
+            phones = [phones]
+        birthday = row.get("birthday")
+        name = Name(row["name"]).value
+        if not name:
+            raise ErrorWithMsg("Name must not be empty")
+        return cls.from_values(
+            name,
+            [Phone(phone).number for phone in phones],
+            Birthday(birthday).value if birthday else None,
+        )
+
+    @classmethod
+    def from_values(cls, name: str, phones, birthday: date = None):
+        """Create a record from already validated values."""
+        record = cls.__new__(cls)
+        record.__setstate__((name, array("Q", phones), birthday))
+        return record
+
     def __find_phone_index__(self, phone):
-        phone = Phone(phone)
-        for i, i_phone in enumerate(self.phones):
-            if i_phone.value == phone.value:
-                return i
-        raise ErrorWithMsg("Phone number is not in the list")
+        try:
+            return self.phones.index(Phone(phone).number)
+        except ValueError:
+            raise ErrorWithMsg("Phone number is not in the list")
+
+    def notify_book(func):
+        def inner(*args, **kwargs):
+            __self = args[0]
+            book = __self.__book
+            if book is None:
+                return func(*args, **kwargs)
+            with book.lock:
+                old_phones = __self.phones.tolist()
+                old_birthday = __self.birthday
+                ret = func(*args, **kwargs)
+                changed = book.record_changed(__self, old_phones, old_birthday)
+            if changed:
+                book.changed()
+            return ret
+
+        return inner
+
+    def attach(self, book):
+        self.__book = book
 
     def get_name(self) -> str:
         return self.name.value
 
+    def get_phones(self) -> list:
+        return [Phone.format(p) for p in self.phones]
+
+    @notify_book
     def add_phone(self, phone: str):
-        self.phones.append(Phone(phone))
+        self.phones.append(Phone(phone).number)
 
+    @notify_book
     def remove_phone(self, phone: str):
-        self.phones.pop(Phone(phone))
+        self.phones.pop(self.__find_phone_index__(phone))
 
+    @notify_book
     def edit_phone(self, old_phone: str, new_phone: str):
-        self.phones[self.__find_phone_index__(old_phone)] = Phone(new_phone)
+        index = self.__find_phone_index__(old_phone)
+        self.phones[index] = Phone(new_phone).number
 
+    @notify_book
     def replace_phone(self, new_phone: str):
         if len(self.phones) == 0:
-            raise ErrorWithMsg("Contact '{self.name.value}' has no phone.")
-        self.phones[0] = Phone(new_phone)
+            raise ErrorWithMsg(f"Contact '{self.name.value}' has no phone.")
+        self.phones[0] = Phone(new_phone).number
 
     def get_phone(self) -> str:
         if len(self.phones) == 0:
-            raise ErrorWithMsg("Contact '{self.name.value}' has no phone.")
-        return self.phones[0].value
+            raise ErrorWithMsg(f"Contact '{self.name.value}' has no phone.")
+        return Phone.format(self.phones[0])
 
     def find_phone(self, phone: str) -> Phone:
-        return self.phones[self.__find_phone_index__(phone)]
+        index = self.__find_phone_index__(phone)
+        return Phone(Phone.format(self.phones[index]))
 
+    @notify_book
     def add_birthday(self, birthday: str):
-        self.birthday = Birthday(birthday)
+        self.birthday = Birthday(birthday).value
 
     def show_birthday(self):
-        birthday = self.birthday.value
-        if birthday is None:
+        if self.birthday is None:
             raise ErrorWithMsg("Birthday is not set")
-        return birthday
+        return Birthday.format(self.birthday)
 
 
 class AddressBook(UserDict):
     """Class for storing and managing records."""
 
-    def __init__(self, filename: str = None):
+    JOURNAL_SUFFIX = ".log"
+    FEED_SUFFIX = ".feed"
+    # Storage formats by the extension of the file, pickle is the default
+    FORMATS = {
+        ".json": "json",
+        ".jsonl": "json",
+        ".sqlite": "sqlite",
+        ".db": "sqlite",
+        ".ibin": "indexed",
+        ".shards": "sharded",
+    }
+
+    def __init__(
+        self,
+        filename: str = None,
+        journal: bool = False,
+        compact_threshold: int = 1000,
+        write_behind: bool = False,
+        flush_interval: float = 1.0,
+        flush_count: int = 100,
+        concurrent: bool = False,
+        metrics: Metrics = None,
+        shards: int = None,
+        workers: int = None,
+        feed_size: int = 10000,
+    ):
         super().__init__()
+        self.metrics = metrics if metrics is not None else Metrics()
+        # In concurrent mode lookups and saving share the read lock,
+        # changes take the lock exclusively
+        if concurrent:
+            self.lock = RWLock()
+            self.read_lock = self.lock.reader
+        else:
+            self.lock = threading.RLock()
+            self.read_lock = self.lock
+        self.__io_lock = threading.RLock()
         self.__dump_to_file = self.dummy_dump_to_file
         self.__filename = filename
+        self.__dirty = {}
+        self.__format = None
+        self.__in_memory = True
+        self.__shards = shards
+        self.__workers = workers
+        self.__phone_index = {}
+        self.__birthday_index = defaultdict(set)
+        # Built on the first sorted query, then kept up to date
+        self.__sorted_names = None
+        self.__name_index = None
+        # Only one reader builds them
+        self.__index_lock = threading.Lock()
+        # Bumped by every change of the records, keys the cached results
+        self.version = 0
+        self.__birthdays_cache = None
+        self.__listeners = []
+        self.__cleared = False
+        self.__journal = None
+        self.__journal_size = 0
+        self.__flusher = None
+        self.__deferred = False
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.compact_threshold = compact_threshold
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
         if self.__filename:
-            if filename.endswith(".json"):
-                print("JSON does not supported yet. Please use bin file.")
-                exit(1)
-                self.__serializer = json
-                self.__file_mode = ""
-            else:
-                self.__serializer = pickle
-                self.__file_mode = "b"
-            self.__dump_to_file = self.write_to_file
-            self.load_from_file()
+            self.__format = self.storage_format(filename)
+            if self.__format == "sqlite":
+                self.__open_sqlite()
+            if self.__in_memory:
+                self.__dump_to_file = self.write_to_file
+                self.load_from_file()
+            if journal and self.__in_memory:
+                self.__dump_to_file = self.write_to_journal
+                self.load_from_journal()
+                self.__journal = open(self.journal_filename, "ab")
+            if write_behind:
+                self.__flusher = threading.Thread(
+                    target=self.__flush_loop, daemon=True
+                )
+                self.__flusher.start()
+                atexit.register(self.close)
+        # The last feed_size changes are kept for replicas
+        self.feed = None
+        if feed_size:
+            from changefeed import ChangeFeed
+
+            self.feed = ChangeFeed(self, feed_size)
+        if self.__filename:
+            # The feed of the last run is continued, it is saved by close()
+            if self.feed is not None:
+                self.feed.load(self.feed_filename)
+            elif os.path.isfile(self.feed_filename):
+                # Changes of this run are not in the saved feed
+                os.remove(self.feed_filename)
+
+    @staticmethod
+    def storage_format(filename: str) -> str:
+        for extension, storage in AddressBook.FORMATS.items():
+            if filename.endswith(extension):
+                return storage
+        return "pickle"
+
+    def __open_sqlite(self):
+        # Imported here, so the pickle books do not need sqlite3 at all
+        from sqlitebook import SqliteRecords
+
+        try:
+            self.data = SqliteRecords(self.__filename, self)
+        except Exception as e:
+            print(
+                f"Can not open addressbook database '{self.__filename}':",
+                type(e).__name__,
+            )
+            exit(1)
+        self.__in_memory = False
+        # The database connection serves one thread at a time
+        self.read_lock = self.lock
+        self.__phone_index = None
+        self.__birthday_index = None
+        self.__dump_to_file = self.commit_to_database
+
+    def commit_to_database(self):
+        # Statements are executed under the lock, commit must not split them
+        with self.lock:
+            self.__take_changes()
+            self.data.commit()
+
+    @property
+    def journal_filename(self):
+        return self.__filename + AddressBook.JOURNAL_SUFFIX
+
+    @property
+    def feed_filename(self):
+        return self.__filename + AddressBook.FEED_SUFFIX
+
+    def save_feed(self):
+        """Save the change feed to continue it in the next run of the book."""
+        if self.__filename and self.feed is not None:
+            with self.read_lock:
+                self.feed.save(self.feed_filename)
+
+    def __take_changes(self):
+        # Must be called under the lock
+        changes = [("clear",)] if self.__cleared else []
+        changes.extend(self.__dirty.values())
+        self.__dirty.clear()
+        self.__cleared = False
+        return changes
 
     def write_to_file(self):
-        with open(self.__filename, "w" + self.__file_mode) as fd:
-            self.__serializer.dump(self.data, fd)
+        if not self.__in_memory:
+            # The records of a database are saved by commit
+            self.commit_to_database()
+            return
+        with self.__io_lock:
+            # Writers wait for a consistent snapshot, lookups do not,
+            # the snapshot is written outside the lock
+            with self.read_lock, self.metrics.timer("save.serialize"):
+                self.__take_changes()
+                snapshot = self.__snapshot()
+            self.__write_snapshot(snapshot)
+
+    def __snapshot(self):
+        # Must be called under the read lock
+        if self.__format == "indexed":
+            return self.data.snapshot(
+                self.__phone_index, self.__birthday_index
+            )
+        if self.__format == "sharded":
+            # Only the changed shards are serialized
+            return self.data.snapshot()
+        if self.__format == "json":
+            # Only the values are copied, the lines are formatted later
+            import jsonbook
+
+            return jsonbook.snapshot(self.data.values())
+        import pickle
+
+        return pickle.dumps(self.data)
+
+    def __write_snapshot(self, snapshot):
+        if self.__format in ("indexed", "sharded"):
+            self.data.write(snapshot)
+            return
+        if self.__format == "json":
+            import jsonbook
+
+            jsonbook.write(self.__filename, snapshot)
+            return
+        # Write to a temporary file first, a crash must not corrupt the book
+        tmp_filename = self.__filename + ".tmp"
+        with open(tmp_filename, "wb") as fd:
+            fd.write(snapshot)
+            # Must be on disk before compact() truncates the journal
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_filename, self.__filename)
 
     def load_from_file(self):
-        if not os.path.isfile(self.__filename):
+        if not self.__in_memory:
+            # The records of a database are read on access
+            return
+        self.version += 1
+        if self.__format == "indexed":
+            self.__load_indexed()
+            return
+        if self.__format == "sharded":
+            self.__load_sharded()
+        elif not os.path.isfile(self.__filename):
             return
+        elif self.__format == "json":
+            self.__load_json()
+        else:
+            import pickle
+
+            try:
+                with open(self.__filename, "rb") as fd:
+                    self.data = pickle.load(fd)
+            except:
+                print(
+                    f"Can not load addressbook from the file '{self.__filename}'"
+                )
+        self.__phone_index.clear()
+        self.__birthday_index.clear()
+        for name, record in self.data.items():
+            record.attach(self)
+            self.__index_phones(name, record.phones)
+            self.__index_birthday(name, record.birthday)
+
+    def __load_indexed(self):
+        # Only the index is read, the records are loaded on access
+        from indexedbook import IndexedRecords
+
         try:
-            with open(self.__filename, "r" + self.__file_mode) as fd:
-                self.data = self.__serializer.load(fd)
-        except:
+            self.data = IndexedRecords(self.__filename, self)
+        except Exception as e:
             print(
-                f"Can not load addressbook from the file '{self.__filename}'"
+                f"Can not load addressbook from the file '{self.__filename}':",
+                type(e).__name__,
             )
+            exit(1)
+        if self.data.phone_index is not None:
+            self.__phone_index = self.data.phone_index
+            self.__birthday_index = self.data.birthday_index
+
+    def __load_json(self):
+        # Records are parsed line by line, a damaged book is not overwritten
+        import jsonbook
+
+        data = {}
+        # The new records would be scanned by the collector again and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for record in jsonbook.read(self.__filename):
+                data[record.get_name()] = record
+        except (OSError, ValueError) as e:
+            print(
+                f"Can not load addressbook from the file '{self.__filename}':",
+                e,
+            )
+            exit(1)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.data = data
+
+    def __load_sharded(self):
+        # Shard files are read in parallel, the indexes are built as usual
+        from shardedbook import ShardedRecords
+
+        try:
+            self.data = ShardedRecords(
+                self.__filename, self.__shards, self.__workers
+            )
+        except Exception as e:
+            print(
+                f"Can not load addressbook from the file '{self.__filename}':",
+                type(e).__name__,
+            )
+            exit(1)
+
+    def write_to_journal(self):
+        with self.__io_lock:
+            if (
+                self.__journal_size + len(self.__dirty)
+                >= self.compact_threshold
+            ):
+                # A snapshot is cheaper than journaling that many changes
+                self.compact()
+                return
+            import pickle
+
+            with self.read_lock, self.metrics.timer("save.serialize"):
+                changes = self.__take_changes()
+                chunk = b"".join(pickle.dumps(c) for c in changes)
+            if not changes:
+                return
+            self.__journal.write(chunk)
+            self.__journal.flush()
+            os.fsync(self.__journal.fileno())
+            self.__journal_size += len(changes)
+            if self.__journal_size >= self.compact_threshold:
+                self.compact()
+
+    def load_from_journal(self, repair: bool = True):
+        """Replay the journal, a damaged tail is cut off unless repair is False."""
+        import pickle
+
+        if not os.path.isfile(self.journal_filename):
+            return
+        # The end of the last complete change
+        good_size = 0
+        with open(self.journal_filename, "rb") as fd:
+            while True:
+                try:
+                    change = pickle.load(fd)
+                except:
+                    break
+                self.apply_change(change)
+                self.__journal_size += 1
+                good_size = fd.tell()
+        if good_size < os.path.getsize(self.journal_filename):
+            # The tail of the journal may be cut by a crash, new changes
+            # appended after it would be skipped on the next start as well
+            print(
+                f"Journal '{self.journal_filename}' is damaged, "
+                "the rest of it is skipped"
+            )
+            if repair:
+                os.truncate(self.journal_filename, good_size)
+        if self.__journal_size >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and truncate it."""
+        with self.__io_lock:
+            self.write_to_file()
+            # Replaying the journal over the new snapshot is harmless,
+            # so a crash between these two steps loses nothing
+            if self.__journal:
+                self.__journal.truncate(0)
+            elif os.path.isfile(self.journal_filename):
+                os.remove(self.journal_filename)
+            self.__journal_size = 0
+
+    def apply_change(self, change):
+        op, *args = change
+        if op == "put":
+            self.__put(*args)
+        elif op == "del":
+            self.__pop(*args)
+        elif op == "clear":
+            self.__clear()
+
+    def __put(self, name, record):
+        self.__pop(name)
+        self.version += 1
+        record.attach(self)
+        self.data[name] = record
+        self.__index_record(name, record)
+
+    def __pop(self, name):
+        record = self.data.pop(name, None)
+        if record is not None:
+            self.version += 1
+            record.attach(None)
+            self.__unindex_record(name, record)
+        return record
+
+    def __clear(self):
+        self.version += 1
+        if self.__in_memory:
+            self.__phone_index.clear()
+            self.__birthday_index.clear()
+            self.__sorted_names = None
+        self.__name_index = None
+        self.data.clear()
+
+    def __index_record(self, name, record):
+        if self.__name_index is not None:
+            self.__name_index.add(name)
+        # The database keeps its own indexes
+        if self.__in_memory:
+            self.__index_phones(name, record.phones)
+            self.__index_birthday(name, record.birthday)
+            if self.__sorted_names is not None:
+                insort(self.__sorted_names, name)
+
+    def __unindex_record(self, name, record):
+        if self.__name_index is not None:
+            self.__name_index.remove(name)
+        if self.__in_memory:
+            self.__unindex_phones(name, record.phones)
+            self.__unindex_birthday(name, record.birthday)
+            if self.__sorted_names is not None:
+                i = bisect_left(self.__sorted_names, name)
+                del self.__sorted_names[i]
+
+    def sorted_names(self) -> list:
+        with self.read_lock:
+            if self.__sorted_names is None:
+                # Changes wait for the list, other readers do not
+                with self.__index_lock:
+                    if self.__sorted_names is None:
+                        self.__sorted_names = sorted(self.data)
+            return self.__sorted_names
+
+    def __index_phones(self, name, phones):
+        # Most numbers have one owner, a set is created only for shared ones
+        for phone in phones:
+            names = self.__phone_index.get(phone)
+            if names is None:
+                self.__phone_index[phone] = name
+            elif type(names) is set:
+                names.add(name)
+            elif names != name:
+                self.__phone_index[phone] = {names, name}
+
+    def __unindex_phones(self, name, phones):
+        for phone in phones:
+            names = self.__phone_index.get(phone)
+            if names == name:
+                del self.__phone_index[phone]
+            elif type(names) is set:
+                names.discard(name)
+                if len(names) == 1:
+                    self.__phone_index[phone] = names.pop()
+
+    @staticmethod
+    def __birthday_key(birthday: date):
+        return birthday.month, birthday.day
+
+    def __index_birthday(self, name, birthday):
+        if birthday:
+            self.__birthday_index[self.__birthday_key(birthday)].add(name)
+
+    def __unindex_birthday(self, name, birthday):
+        if not birthday:
+            return
+        key = self.__birthday_key(birthday)
+        names = self.__birthday_index.get(key)
+        if names is None:
+            return
+        names.discard(name)
+        if not names:
+            del self.__birthday_index[key]
+
+    def add_listener(self, listener):
+        """Call listener(op, name, record) on every change, under the book lock.
+
+        op is "put", "del" (record is None) or "clear" (name is None too).
+        """
+        with self.lock:
+            self.__listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            self.__listeners.remove(listener)
+
+    def track_change(self, op, name=None, record=None):
+        with self.lock:
+            if op == "clear":
+                self.__dirty.clear()
+                self.__cleared = True
+            elif op == "del":
+                self.__dirty[name] = (op, name)
+            else:
+                self.__dirty[name] = (op, name, record)
+            for listener in self.__listeners:
+                listener(op, name, record)
+
+    def record_changed(
+        self, record: Record, old_phones: list, old_birthday: date
+    ):
+        name = record.get_name()
+        with self.lock:
+            if self.data.get(name) is not record:
+                return False
+            self.version += 1
+            if self.__in_memory:
+                old_phones = set(old_phones)
+                new_phones = set(record.phones)
+                self.__unindex_phones(name, old_phones - new_phones)
+                self.__index_phones(name, new_phones - old_phones)
+                self.__unindex_birthday(name, old_birthday)
+                self.__index_birthday(name, record.birthday)
+            if self.__format == "sharded" or not self.__in_memory:
+                # Marks the shard to be rewritten or updates the database
+                self.data[name] = record
+            self.track_change("put", name, record)
+        return True
+
+    def defer_saving(self, deferred: bool = True):
+        """Keep changes in memory until dump_to_file() or close() is called."""
+        self.__deferred = deferred
+        if not deferred:
+            self.dump_to_file()
+
+    def changed(self):
+        if self.__deferred:
+            return
+        if self.__flusher is None:
+            self.dump_to_file()
+        elif len(self.__dirty) >= self.flush_count:
+            self.__wakeup.set()
+
+    def __flush_loop(self):
+        while not self.__stop.is_set():
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            with self.read_lock:
+                # An idle book is not rewritten every interval
+                idle = not self.__dirty and not self.__cleared
+            if idle:
+                continue
+            try:
+                self.dump_to_file()
+            except Exception as e:
+                print(
+                    f"Can not save addressbook to the file '{self.__filename}':",
+                    type(e).__name__,
+                )
 
     def save_data(func):
         def inner(*args, **kwargs):
-            ret = func(*args, **kwargs)
             __self = args[0]
-            __self.dump_to_file()
+            with __self.lock:
+                ret = func(*args, **kwargs)
+            __self.changed()
             return ret
 
         return inner
 
     def dump_to_file(self):
         # Will be used by decorator
-        return self.__dump_to_file()
+        with self.metrics.timer("save.flush"):
+            return self.__dump_to_file()
 
-    def dummy_dump_to_file():
-        pass
+    def dummy_dump_to_file(self):
+        with self.lock:
+            self.__take_changes()
+
+    def close(self):
+        """Stop background flushing and save all pending changes."""
+        if self.__flusher is not None:
+            self.__stop.set()
+            self.__wakeup.set()
+            self.__flusher.join()
+            self.__flusher = None
+            atexit.unregister(self.close)
+        self.dump_to_file()
+        # Only a book closed properly continues its feed, a replica
+        # gets a full copy after a crash
+        self.save_feed()
+        if self.__journal:
+            self.__journal.close()
+            self.__journal = None
+            self.__dump_to_file = self.dummy_dump_to_file
+        if self.__format == "indexed":
+            self.data.close()
+        if self.__dump_to_file == self.commit_to_database:
+            self.data.close()
+            self.__dump_to_file = self.dummy_dump_to_file
 
     def __iter__(self):
         if len(self.data) == 0:
             raise ErrorWithMsg(f"Addressbook is empty.")
         return super().__iter__()
 
+    def values(self):
+        if len(self.data) == 0:
+            raise ErrorWithMsg(f"Addressbook is empty.")
+        return self.data.values()
+
+    def iter_records(self, by_name=False, offset: int = 0, limit: int = None):
+        """Return an iterator over records, optionally sorted by name and paginated."""
+        if not self.__in_memory:
+            if len(self.data) == 0:
+                raise ErrorWithMsg(f"Addressbook is empty.")
+            # The database returns records sorted by name
+            return self.data.values(offset, -1 if limit is None else limit)
+        stop = None if limit is None else offset + limit
+        with self.read_lock:
+            if len(self.data) == 0:
+                raise ErrorWithMsg(f"Addressbook is empty.")
+            if by_name:
+                names = self.sorted_names()[offset:stop]
+            else:
+                names = list(islice(self.data, offset, stop))
+        # Records are looked up while iterating, deleted ones are skipped
+        records = map(self.data.get, names)
+        return (record for record in records if record is not None)
+
     def __getitem__(self, name):
-        if not name in self.data:
-            raise ErrorWithMsg(f"Contact '{name}' does not exist.")
-        return self.data[name]
+        with self.read_lock:
+            if not name in self.data:
+                raise ErrorWithMsg(f"Contact '{name}' does not exist.")
+            return self.data[name]
 
     @save_data
     def __setitem__(self, name, value):
         # Can change only existing records
         if not name in self.data:
             raise ErrorWithMsg(f"Contact '{name}' does not exist.")
-        self.data[name] = value
+        self.__put(name, value)
+        self.track_change("put", name, value)
 
     @save_data
     def add_record(self, record: Record):
@@ -200,31 +869,176 @@ class AddressBook(UserDict):
             raise ErrorWithMsg(
                 f"Contact '{record.name.value}' already exists."
             )
-        self.data[record.name.value] = record
+        self.__put(record.name.value, record)
+        self.track_change("put", record.name.value, record)
+
+    def import_records(self, rows, batch_size: int = 10000):
+        """Add records from dicts (see Record.from_dict), the book is saved once.
+
+        Returns the number of added records and a list of (row number, error).
+        """
+        imported = 0
+        errors = []
+        batch = []
+        for row_number, row in enumerate(rows, 1):
+            try:
+                if row is None:
+                    raise ErrorWithMsg("Can not parse the row")
+                batch.append((row_number, Record.from_dict(row)))
+            except ErrorWithMsg as e:
+                errors.append((row_number, str(e)))
+            except (KeyError, TypeError, AttributeError):
+                errors.append((row_number, "Invalid row format"))
+            if len(batch) >= batch_size:
+                imported += self.__add_batch(batch, errors)
+                batch = []
+        imported += self.__add_batch(batch, errors)
+        if imported:
+            self.changed()
+        return imported, errors
+
+    def __add_batch(self, batch, errors):
+        added = 0
+        with self.lock:
+            if len(batch) > len(self.data):
+                # Sorting once later is cheaper than inserting one by one
+                self.__sorted_names = None
+                self.__name_index = None
+            for row_number, record in batch:
+                name = record.get_name()
+                if name in self.data:
+                    errors.append(
+                        (row_number, f"Contact '{name}' already exists.")
+                    )
+                    continue
+                self.__put(name, record)
+                self.track_change("put", name, record)
+                added += 1
+        return added
 
     def find(self, name: str) -> Record:
         return self[name]
 
-    def get_all_birthdays(self):
+    def search(self, query: str, limit: int = 10, max_distance: int = 2):
+        """Return names starting with the query (case-insensitive),
+        completed by the names within max_distance edits from it."""
+        with self.read_lock:
+            if self.__name_index is None:
+                # Changes wait for the index, other readers do not
+                with self.__index_lock:
+                    if self.__name_index is None:
+                        # Only names are kept in memory, so it works for SQLite too
+                        self.__name_index = NameIndex(iter(self.data))
+            names = self.__name_index.prefix(query, limit)
+            if len(names) < limit and max_distance > 0:
+                for name in self.__name_index.fuzzy(
+                    query, max_distance, limit
+                ):
+                    if len(names) >= limit:
+                        break
+                    if name not in names:
+                        names.append(name)
+        if not names:
+            raise ErrorWithMsg(f"No contacts found for '{query}'.")
+        return names
+
+    def find_by_phone(self, phone: str) -> list:
+        phone = Phone(phone)
+        with self.read_lock:
+            if self.__in_memory:
+                names = self.__phone_index.get(phone.number)
+            else:
+                names = self.data.names_by_phone(phone.number) or None
+            if names is None:
+                raise ErrorWithMsg(
+                    f"Phone number '{phone.value}' does not exist."
+                )
+            if type(names) is str:
+                return [names]
+            return sorted(names)
+
+    def get_all_birthdays(self, names=None):
         birthday_list = []
-        for record in self.data.values():
-            birthday = record.birthday.value
-            if birthday:
+        if names is None:
+            records = self.data.values()
+        else:
+            records = (self.data[name] for name in names)
+        for record in records:
+            if record.birthday:
                 birthday_list.append(
                     {
                         "name": record.name.value,
-                        "birthday": datetime.strptime(birthday, "%d.%m.%Y"),
+                        "birthday": datetime.combine(record.birthday, time()),
                     }
                 )
         return birthday_list
 
-    def get_birthdays_per_week(self):
-        return birthdays.get_birthdays_per_week(self.get_all_birthdays())
+    def get_birthdays_per_week(self, today=None):
+        import birthdays
+
+        if not today:
+            today = datetime.today().date()
+        start = perf_counter()
+        # The result changes only with the date or the records
+        with self.read_lock:
+            key = (today, self.version)
+            cached = self.__birthdays_cache
+            if cached is not None and cached[0] == key:
+                self.metrics.record("birthdays.hit", perf_counter() - start)
+                return cached[1]
+            # Only the buckets of the days of the week are checked
+            keys = birthdays.get_week_dates(today)
+            if self.__in_memory:
+                names = set()
+                for week_key in keys:
+                    names.update(self.__birthday_index.get(week_key, ()))
+            else:
+                names = self.data.names_by_birthday(keys)
+            users = self.get_all_birthdays(names)
+        result = birthdays.get_birthdays_per_week(users, today=today)
+        self.__birthdays_cache = (key, result)
+        self.metrics.record("birthdays.miss", perf_counter() - start)
+        return result
 
     @save_data
     def delete(self, name: str):
-        self.data.pop(name)
+        if self.__pop(name) is None:
+            raise ErrorWithMsg(f"Contact '{name}' does not exist.")
+        self.track_change("del", name)
 
     @save_data
     def delete_all(self):
-        self.data.clear()
+        self.__clear()
+        self.track_change("clear")
+
+    @save_data
+    def apply_changes(self, rows) -> int:
+        """Apply the changes exported by ChangeFeed of another book.
+
+        Rows are validated first, so a bad file changes nothing.
+        """
+        changes = []
+        for row in rows:
+            try:
+                op = row.get("op")
+                if op == "put":
+                    changes.append((op, Record.from_dict(row)))
+                elif op == "del" and type(row.get("name")) is str:
+                    changes.append((op, row["name"]))
+                elif op == "clear":
+                    changes.append((op, None))
+                else:
+                    raise KeyError(op)
+            except (KeyError, TypeError, AttributeError):
+                raise ErrorWithMsg(f"Invalid change: {row}")
+        for op, value in changes:
+            if op == "put":
+                self.__put(value.name.value, value)
+                self.track_change(op, value.name.value, value)
+            elif op == "del":
+                if self.__pop(value) is not None:
+                    self.track_change(op, value)
+            else:
+                self.__clear()
+                self.track_change(op)
+        return len(changes)
@@ -0,0 +1,365 @@
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from time import perf_counter
+
+import cliargs
+from addressbook import AddressBook, Record
+from bot import Bot
+
+FIRST_NAMES = (
+    "Anna", "Bohdan", "Daria", "Ivan", "Kateryna", "Maksym", "Olena",
+    "Petro", "Sofiia", "Taras", "Yulia", "Andrii", "Iryna", "Oleh",
+)
+LAST_NAMES = (
+    "Bondar", "Hnatiuk", "Kovalenko", "Kravets", "Lysenko", "Melnyk",
+    "Moroz", "Shevchenko", "Tkachenko", "Savchenko", "Rudenko", "Boiko",
+)
+BIRTHDAY_DAYS = (date(2005, 12, 31) - date(1940, 1, 1)).days
+
+
+def generate_contacts(count: int, seed: int = 1):
+    """Return a list of (name, phones, birthday), the same for the same seed.
+
+    Names are unique and have no spaces, 80% of the contacts have a birthday.
+    """
+    rnd = random.Random(seed)
+    first_day = date(1940, 1, 1)
+    contacts = []
+    for i in range(count):
+        name = f"{rnd.choice(FIRST_NAMES)}{rnd.choice(LAST_NAMES)}{i}"
+        phones = [
+            rnd.randrange(1_000_000_000, 10_000_000_000)
+            for _ in range(rnd.randint(1, 3))
+        ]
+        birthday = None
+        if rnd.random() < 0.8:
+            birthday = first_day + timedelta(days=rnd.randrange(BIRTHDAY_DAYS))
+        contacts.append((name, phones, birthday))
+    return contacts
+
+
+def bench_add_record(ctx):
+    records = [Record.from_values(*contact) for contact in ctx["contacts"]]
+    book = AddressBook(ctx["filename"])
+    # Only add_record is measured, the book is saved by write_to_file
+    book.defer_saving()
+    latencies = []
+    for record in records:
+        start = perf_counter()
+        book.add_record(record)
+        latencies.append(perf_counter() - start)
+    ctx["book"] = book
+    return latencies, len(records)
+
+
+def bench_write_to_file(ctx):
+    latencies = []
+    for _ in range(ctx["repeat"]):
+        start = perf_counter()
+        ctx["book"].write_to_file()
+        latencies.append(perf_counter() - start)
+    return latencies, len(ctx["book"].data) * len(latencies)
+
+
+def bench_load_from_file(ctx):
+    # A new book is created each time, so the indexes are built as well
+    latencies = []
+    for _ in range(ctx["repeat"]):
+        ctx["book"] = None
+        gc.collect()
+        start = perf_counter()
+        ctx["book"] = AddressBook(ctx["filename"])
+        latencies.append(perf_counter() - start)
+    return latencies, len(ctx["book"].data) * len(latencies)
+
+
+def bench_find(ctx):
+    rnd = random.Random(2)
+    names = [name for name, _, _ in ctx["contacts"]]
+    names = [rnd.choice(names) for _ in range(ctx["queries"])]
+    book = ctx["book"]
+    latencies = []
+    for name in names:
+        start = perf_counter()
+        book.find(name)
+        latencies.append(perf_counter() - start)
+    return latencies, len(names)
+
+
+def bench_all(ctx):
+    bot = Bot(ctx["book"])
+    latencies = []
+    items = 0
+    for _ in range(ctx["repeat"]):
+        start = perf_counter()
+        for line in bot.all([]):
+            items += 1
+        latencies.append(perf_counter() - start)
+    return latencies, items
+
+
+def bench_birthdays(ctx):
+    # The same days of the year for every run
+    first_day = date(2024, 1, 1)
+    latencies = []
+    for i in range(7 * ctx["repeat"]):
+        today = first_day + timedelta(days=i * 53)
+        start = perf_counter()
+        ctx["book"].get_birthdays_per_week(today)
+        latencies.append(perf_counter() - start)
+    return latencies, len(latencies)
+
+
+# The order matters: the following benchmarks use the book of the previous ones
+BENCHMARKS = (
+    ("add_record", bench_add_record),
+    ("write_to_file", bench_write_to_file),
+    ("load_from_file", bench_load_from_file),
+    ("find", bench_find),
+    ("all", bench_all),
+    ("birthdays", bench_birthdays),
+)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    i = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def summarize(latencies: list, items: int) -> dict:
+    total = sum(latencies)
+    latencies = sorted(latencies)
+    return {
+        "items": items,
+        "seconds": round(total, 6),
+        "items_per_s": round(items / total, 1) if total else None,
+        "p50_us": round(percentile(latencies, 50) * 1e6, 2),
+        "p95_us": round(percentile(latencies, 95) * 1e6, 2),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 2),
+    }
+
+
+def file_size(filename: str) -> int:
+    if not os.path.isdir(filename):
+        # Committed changes of a database may still be in its WAL file
+        wal = filename + "-wal"
+        wal_size = os.path.getsize(wal) if os.path.isfile(wal) else 0
+        return os.path.getsize(filename) + wal_size
+    # Sharded books are directories
+    return sum(
+        os.path.getsize(os.path.join(filename, name))
+        for name in os.listdir(filename)
+    )
+
+
+def run_size(
+    size: int, repeat: int = 3, queries: int = 10000, memory=True, format="bin"
+):
+    """Run all the benchmarks for a book of the given size and file format."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ctx = {
+            "contacts": generate_contacts(size),
+            "filename": os.path.join(tmp_dir, "book." + format),
+            "repeat": repeat,
+            "queries": queries,
+        }
+        for name, bench in BENCHMARKS:
+            gc.collect()
+            result = summarize(*bench(ctx))
+            if name == "write_to_file":
+                result["file_kib"] = file_size(ctx["filename"]) // 1024
+            if memory:
+                # A separate run, tracing slows down the measured one.
+                # Its book is dropped, a new one goes to another file:
+                # the measured book keeps a database locked until it is saved
+                traced = dict(ctx)
+                if name == "add_record":
+                    traced["filename"] = os.path.join(
+                        tmp_dir, "traced." + format
+                    )
+                gc.collect()
+                tracemalloc.start()
+                bench(traced)
+                result["peak_kib"] = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+                traced = None
+            results[name] = result
+            print_result(size, name, result)
+    return results
+
+
+def print_result(size, name, result):
+    print(
+        "{:>9} {:<15} {:>12} items/s  p50 {:>10} us  p95 {:>10} us  "
+        "p99 {:>10} us  peak {:>9} KiB{}".format(
+            size,
+            name,
+            result["items_per_s"],
+            result["p50_us"],
+            result["p95_us"],
+            result["p99_us"],
+            result.get("peak_kib", "-"),
+            f"  file {result['file_kib']} KiB" if "file_kib" in result else "",
+        )
+    )
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print the changes against the baseline, return the regressions.
+
+    A regression is a throughput drop or a p95 latency growth by more than
+    threshold percents.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            throughput = (
+                result["items_per_s"] / base["items_per_s"] - 1
+            ) * 100
+            p95 = (result["p95_us"] / base["p95_us"] - 1) * 100
+            regressed = throughput < -threshold or p95 > threshold
+            print(
+                "{:>9} {:<15} throughput {:>+7.1f}%  p95 {:>+7.1f}%{}".format(
+                    size, name, throughput, p95, "  REGRESSION" if regressed else ""
+                )
+            )
+            if regressed:
+                regressions.append((size, name))
+    return regressions
+
+
+# Modules which must not be imported before the bot prompt is shown
+LAZY_MODULES = ("pickle", "json", "birthdays", "concurrent.futures", "numpy")
+
+IMPORTS_SCRIPT = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import main
+print((perf_counter() - start) * 1000)
+print(",".join(name for name in {lazy!r} if name in sys.modules))
+"""
+
+
+def check_imports(budget_ms: float, repeat: int) -> bool:
+    """Check the import time of main.py and that the heavy modules are lazy.
+
+    Every run is a new interpreter, the best time is compared with the budget.
+    """
+    script = IMPORTS_SCRIPT.format(lazy=LAZY_MODULES)
+    times = []
+    imported = ""
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        times.append(float(out[0]))
+        imported = out[1] if len(out) > 1 else ""
+    ok = True
+    print(f"import main: {min(times):.1f} ms (budget {budget_ms:g} ms)")
+    if min(times) > budget_ms:
+        print("  REGRESSION: the import time is over the budget")
+        ok = False
+    if imported:
+        print(f"  REGRESSION: imported at start: {imported}")
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    __usage_help_message = """
+    Usage:
+        python ./benchmark.py [--sizes=<N,...>] [--repeat=<N>] [--queries=<N>] [--no-memory]
+                              [--save=<file>] [--baseline=<file>] [--threshold=<percent>]
+                              [--format=<extension>]
+        python ./benchmark.py --imports[=<ms>] [--repeat=<N>]
+
+        --sizes=<N,...>:        Numbers of contacts, default is 1000,100000,1000000
+        --repeat=<N>:           Runs of write_to_file, load_from_file and all, default is 3
+                                (birthdays are checked for 7 * <N> days)
+        --queries=<N>:          Number of find() calls, default is 10000
+        --no-memory:            Skip the extra traced runs which measure the peak memory
+        --save=<file>:          Save the results to a JSON file
+        --baseline=<file>:      Compare the results with the saved ones,
+                                the exit code is 1 if there are regressions
+        --threshold=<percent>:  Allowed throughput drop or p95 growth, default is 10
+        --format=<extension>:   File format of the book: bin (pickle, default), jsonl,
+                                ibin, shards or sqlite
+        --imports[=<ms>]:       Only check that main.py is imported in <ms>, default is 50,
+                                and without the modules which are imported lazily,
+                                the exit code is 1 if it is not
+        -h, --help:             Show this message
+
+    Example:
+        $python ./benchmark.py --sizes=1000,100000 --save=baseline.json
+        $python ./benchmark.py --sizes=1000,100000 --baseline=baseline.json
+        $python ./benchmark.py --sizes=100000 --format=jsonl --baseline=baseline.json
+        $python ./benchmark.py --imports=40
+    """
+
+    options = {
+        "sizes": "1000,100000,1000000",
+        "repeat": "3",
+        "queries": "10000",
+        "save": None,
+        "baseline": None,
+        "threshold": "10",
+        "imports": None,
+        "format": "bin",
+        "no-memory": False,
+    }
+    cliargs.parse_args(
+        sys.argv[1:],
+        options,
+        __usage_help_message,
+        flags={"no-memory": True, "imports": "50"},
+    )
+    memory = not options["no-memory"]
+    try:
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        repeat = int(options["repeat"])
+        queries = int(options["queries"])
+        threshold = float(options["threshold"])
+        imports = options["imports"] and float(options["imports"])
+    except ValueError as e:
+        print("Error to parse args:", e)
+        exit(1)
+    if imports:
+        exit(0 if check_imports(imports, repeat) else 1)
+    baseline = None
+    if options["baseline"]:
+        try:
+            with open(options["baseline"], "r") as fd:
+                baseline = json.load(fd)
+        except (OSError, ValueError) as e:
+            print(f"Can not load the baseline '{options['baseline']}':", e)
+            exit(1)
+
+    # JSON keys are strings, sizes are stored the same way
+    results = {}
+    for size in sizes:
+        results[str(size)] = run_size(
+            size, repeat, queries, memory, options["format"]
+        )
+    if options["save"]:
+        with open(options["save"], "w") as fd:
+            json.dump(results, fd, indent=2)
+    if baseline is not None:
+        print()
+        if compare(results, baseline, threshold):
+            exit(1)
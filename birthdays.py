@@ -1,16 +1,102 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime, timedelta, time, date
 from calendar import isleap, day_name
+from itertools import islice
+import gzip
+import json
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_week_dates(today=None):
+    """Return (month, day) of all birthdays which may be congratulated this week."""
+    if not today:
+        today = datetime.today().date()
+    # on Mondays we want to congrats Users from Saturday and Sunday
+    first_day = today - timedelta(days=2 if today.weekday() == 0 else 0)
+    week_dates = []
+    for i in range(7):
+        day = first_day + timedelta(days=i)
+        week_dates.append((day.month, day.day))
+        if day.month == 2 and day.day == 28 and not isleap(today.year):
+            # BD at 29-Feb is celebrated at 28-Feb if non leap year
+            week_dates.append((2, 29))
+    return week_dates
+
+
+# A line of a users file: {'name': 'Bob', 'birthday': datetime.datetime(1990, 3, 5, 0, 0)}
+USER_LINE = re.compile(
+    r"""\s*\{\s*['"]name['"]\s*:\s*(?P<q>['"])(?P<name>.*?)(?P=q)\s*,"""
+    r"""\s*['"]birthday['"]\s*:\s*(?:datetime\.)?(?:datetime|date)\("""
+    r"""\s*(?P<year>\d+)\s*,\s*(?P<month>\d+)\s*,\s*(?P<day>\d+)[\s\d,]*\)\s*\}\s*"""
+)
+
+
+def parse_user_line(line: str):
+    """Return (name, date) of a users file line, ValueError if it is not valid."""
+    match = USER_LINE.fullmatch(line)
+    if match is not None:
+        return match["name"], date(
+            int(match["year"]), int(match["month"]), int(match["day"])
+        )
+    # Other layouts (another order of the keys...) are parsed the slow way
+    in_dict = json.loads(
+        line.replace("'", '"')
+        .replace("datetime.", "")
+        .replace("datetime", "")
+        .replace("(", '"')
+        .replace(")", '"')
+    )
+    year, month, day = in_dict["birthday"].split(",")[:3]
+    return in_dict["name"], date(int(year), int(month), int(day))
+
+
+def read_users(filename: str):
+    """Yield (name, date) from a users file line by line, it may be gzipped."""
+    if filename.endswith(".gz"):
+        fd = gzip.open(filename, "rt")
+    else:
+        fd = open(filename, "r")
+    with fd:
+        for line_number, line in enumerate(fd, 1):
+            if not line.strip():
+                continue
+            try:
+                yield parse_user_line(line)
+            except (ValueError, KeyError, AttributeError) as e:
+                raise ValueError(
+                    f"line {line_number}: {type(e).__name__}"
+                ) from e
 
 
 def get_birthdays_per_week(users, debug=False, today=None):
+    return format_week(group_per_week(users, debug, today))
+
+
+def get_birthdays_per_week_pairs(pairs, debug=False, today=None):
+    """The same as get_birthdays_per_week for an iterable of (name, date)."""
+    return format_week(group_per_week_pairs(pairs, debug, today))
+
+
+def group_per_week(users, debug=False, today=None):
+    """Return names of users to congratulate by weekday (0 is Monday)."""
+    pairs = ((user["name"], user["birthday"].date()) for user in users)
+    return group_per_week_pairs(pairs, debug, today)
+
+
+def group_per_week_pairs(pairs, debug=False, today=None):
     days = defaultdict(list)
     if not today:
         today = datetime.today().date()
     if debug:
         print("Today:", today)
-    for user in users:
-        birthday = user["birthday"].date()
+    for name, birthday in pairs:
+        original_birthday = birthday
         if (
             not isleap(today.year)
             and birthday.month == 2
@@ -64,13 +150,17 @@ def get_birthdays_per_week(users, debug=False, today=None):
             if debug:
                 print(
                     "BD at {}, in {:>2} days ({:>9}), congrats at {:>9}".format(
-                        user["birthday"].date(),
+                        original_birthday,
                         delta_days,
                         day_name[birthday_this_year.weekday()],
                         day_name[congrats_at],
                     )
                 )
-            days[congrats_at].append(user["name"])
+            days[congrats_at].append(name)
+    return days
+
+
+def format_week(days):
     ret_txt = []
     for day in range(7):
         if len(days[day]) > 0:
@@ -80,15 +170,146 @@ def get_birthdays_per_week(users, debug=False, today=None):
     return "\n".join(ret_txt)
 
 
+def users_to_columns(users):
+    """Split a list of user dicts into names, months, days and years columns."""
+    return pairs_to_columns(
+        (user["name"], user["birthday"]) for user in users
+    )
+
+
+def pairs_to_columns(pairs):
+    """Split (name, date) pairs into names, months, days and years columns."""
+    names, months, days, years = [], [], [], []
+    for name, birthday in pairs:
+        names.append(name)
+        months.append(birthday.month)
+        days.append(birthday.day)
+        years.append(birthday.year)
+    return names, months, days, years
+
+
+def get_birthdays_per_week_columns(names, months, days, years, today=None):
+    """The same as get_birthdays_per_week but for columnar input.
+
+    The columns are processed as NumPy arrays if NumPy is installed,
+    otherwise get_birthdays_per_week is used.
+    """
+    return format_week(group_per_week_columns(names, months, days, years, today))
+
+
+# Days of the months of a non leap year
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def group_per_week_columns(names, months, days, years, today=None):
+    if not today:
+        today = datetime.today().date()
+    if np is None:
+        return group_per_week_pairs(
+            zip(names, map(date, years, months, days)), today=today
+        )
+
+    names = np.asarray(names, dtype=object)
+    months = np.asarray(months, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    years = np.asarray(years, dtype=np.int64)
+    # Invalid dates are rejected as by date() without NumPy
+    leap_years = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    in_range = (1 <= months) & (months <= 12) & (1 <= years) & (years <= 9999)
+    month_days = np.asarray(MONTH_DAYS)[np.clip(months, 1, 12) - 1] + (
+        (months == 2) & leap_years
+    )
+    if not np.all(in_range & (1 <= days) & (days <= month_days)):
+        raise ValueError("day is out of range for month")
+    valid = np.ones(len(names), dtype=bool)
+    if not isleap(today.year):
+        # BD at 29-Feb is celebrated at 28-Feb of non leap year
+        days = np.where((months == 2) & (days == 29), 28, days)
+
+    def days_since_epoch(year):
+        first_month = np.datetime64(f"{year:04d}-01", "M")
+        dates = (first_month + (months - 1)).astype("datetime64[D]")
+        return (dates + (days - 1)).astype(np.int64)
+
+    # The same rules as in get_birthdays_per_week
+    today_days = np.datetime64(today, "D").astype(np.int64)
+    is_monday = today.weekday() == 0
+    min_delta = -2 if is_monday else 0
+    birthday_days = days_since_epoch(today.year)
+    delta_days = birthday_days - today_days
+    birthday_days = np.where(
+        delta_days < -(366 - 7),
+        days_since_epoch(today.year + 1),
+        birthday_days,
+    )
+    if is_monday:
+        birthday_days = np.where(
+            delta_days >= 363,
+            days_since_epoch(today.year - 1),
+            birthday_days,
+        )
+    delta_days = birthday_days - today_days
+    valid &= (min_delta <= delta_days) & (delta_days < min_delta + 7)
+
+    # 1970-01-01 is Thursday (day 3)
+    congrats_at = (birthday_days[valid] + 3) % 7
+    congrats_at[congrats_at > 4] = 0
+    names = names[valid]
+    week = defaultdict(list)
+    for day in range(7):
+        day_names = names[congrats_at == day]
+        if len(day_names) > 0:
+            week[day] = day_names.tolist()
+    return week
+
+
+def get_birthdays_per_week_parallel(
+    pairs, today=None, workers=None, chunk_size=100000
+):
+    """The same as get_birthdays_per_week_pairs, the (name, date) pairs are
+    split into chunks which are processed by a pool of worker processes.
+
+    Chunks are sent to the workers as columns, which are much cheaper to
+    pickle than dates. At most two chunks per worker are in flight, so the
+    pairs may be a generator of any length.
+    """
+    # Imported here, it takes longer than the rest of the module
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not today:
+        today = datetime.today().date()
+    workers = workers or os.cpu_count() or 1
+    pairs = iter(pairs)
+    week = defaultdict(list)
+
+    def merge(future):
+        for day, names in future.result().items():
+            week[day].extend(names)
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        while True:
+            chunk = pairs_to_columns(islice(pairs, chunk_size))
+            if not chunk[0]:
+                break
+            pending.append(
+                pool.submit(group_per_week_columns, *chunk, today=today)
+            )
+            if len(pending) >= 2 * workers:
+                merge(pending.popleft())
+        while pending:
+            merge(pending.popleft())
+    return format_week(week)
+
+
 if __name__ == "__main__":
-    import sys, re
-    import json
-    from faker import Faker
+    import sys
     from random import randint
 
     __usage_help_message = """
     Usage:
-        python ./birthday.py [<fake_today_ix>]|[<year month day>] [filename] [--users_number=<N>] [--print_users_only]
+        python ./birthday.py [<fake_today_ix>]|[<year month day>] [filename] [--users_number=<N>] [--print_users_only] [--columns]
+                             [--workers=<N>] [--chunk_size=<N>]
 
         <fake_today_ix>:    Use fake date but not today
                                 List of fake_todays = [
@@ -103,6 +324,10 @@ if __name__ == "__main__":
 
         --print_users_only: Print list of user dicts (1000+ items), and exit
         --users_number=<N>: Generate <N> entries + corner cases, not used if [filename], default is 1000 + corner cases
+        --columns:          Use the columnar engine (vectorized if NumPy is installed)
+        --workers=<N>:      Process the users in chunks by <N> worker processes
+                            (0 is one per CPU), the output is the same
+        --chunk_size=<N>:   Users per chunk in the parallel mode, default is 100000
         -h, --help:         Show this message
 
     Example:
@@ -125,6 +350,9 @@ if __name__ == "__main__":
     def __generate_user_birthdays_test_data(
         num: int, add_corner_cases=False, today=None
     ):
+        # Only the generated data needs Faker
+        from faker import Faker
+
         data = []
         fake = Faker()
         for i in range(num):
@@ -161,7 +389,10 @@ if __name__ == "__main__":
 
     def __args_parser():
         print_users_only = False
+        use_columns = False
         users_number = 1000
+        workers = None
+        chunk_size = 100000
         args = sys.argv[1:]
         for arg in sys.argv[1:]:
             if arg in ("-h", "--help"):
@@ -170,6 +401,20 @@ if __name__ == "__main__":
             if arg == "--print_users_only":
                 print_users_only = True
                 args.remove(arg)
+            if arg == "--columns":
+                use_columns = True
+                args.remove(arg)
+            if arg.startswith(("--workers=", "--chunk_size=")):
+                try:
+                    value = int(arg.split("=")[1])
+                    args.remove(arg)
+                except BaseException as e:
+                    print("Error to parse args:", type(e).__name__)
+                    exit()
+                if arg.startswith("--workers="):
+                    workers = value
+                else:
+                    chunk_size = value
             if "--users_number" in arg:
                 try:
                     users_number = arg.split("=")
@@ -178,7 +423,14 @@ if __name__ == "__main__":
                 except BaseException as e:
                     print("Error to parse args:", type(e).__name__)
                     exit()
-        return args, users_number, print_users_only
+        return (
+            args,
+            users_number,
+            print_users_only,
+            use_columns,
+            workers,
+            chunk_size,
+        )
 
     def __get_today(args):
         fake_today = [
@@ -201,42 +453,53 @@ if __name__ == "__main__":
         return today
 
     def __get_users(args, users_number, in_today):
-        users = []
+        """Return an iterable of (name, date), a file is read lazily."""
         if len(args) == 0 or args[-1].isdigit():
             users = __generate_user_birthdays_test_data(
                 users_number, add_corner_cases=True, today=in_today
             )
-        else:
-            fname = args[-1]
-            try:
-                with open(fname, "r") as file:
-                    for in_data in file.readlines():
-                        in_data = (
-                            in_data.replace("'", '"')
-                            .replace("datetime.", "")
-                            .replace("datetime", "")
-                            .replace("(", '"')
-                            .replace(")", '"')
-                        )
-                        in_dict = json.loads(in_data)
-                        in_date = in_dict["birthday"].split(",")
-                        in_date = date(
-                            int(in_date[0]), int(in_date[1]), int(in_date[2])
-                        )
-                        in_dict["birthday"] = datetime.combine(in_date, time())
-                        users.append(in_dict)
-            except BaseException as e:
-                print(
-                    f"Error to parse input file '{fname}':", type(e).__name__
-                )
-                exit()
-        return users
+            return [(user["name"], user["birthday"].date()) for user in users]
+        return read_users(args[-1])
 
-    args, users_number, print_users_only = __args_parser()
+    (
+        args,
+        users_number,
+        print_users_only,
+        use_columns,
+        workers,
+        chunk_size,
+    ) = __args_parser()
     fake_today = __get_today(args)
     users = __get_users(args, users_number, fake_today)
-    if print_users_only:
-        for user in users:
-            print(user)
+    try:
+        if print_users_only:
+            for name, birthday in users:
+                print(
+                    {"name": name, "birthday": datetime.combine(birthday, time())}
+                )
+            exit()
+        if workers is not None:
+            print(
+                get_birthdays_per_week_parallel(
+                    users,
+                    today=fake_today,
+                    workers=workers,
+                    chunk_size=chunk_size,
+                )
+            )
+        elif use_columns:
+            print(
+                get_birthdays_per_week_columns(
+                    *pairs_to_columns(users), today=fake_today
+                )
+            )
+        else:
+            print(
+                get_birthdays_per_week_pairs(
+                    users, debug=True, today=fake_today
+                )
+            )
+    except (OSError, ValueError) as e:
+        # The file is parsed while the users are processed
+        print(f"Error to parse input file '{args[-1]}':", e)
         exit()
-    print(get_birthdays_per_week(users, debug=True, today=fake_today))
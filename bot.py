@@ -1,4 +1,8 @@
 from collections import defaultdict
+import sys
+import threading
+from time import perf_counter
+from types import GeneratorType
 from addressbook import *
 
 
@@ -13,8 +17,40 @@ class Cmd:
         return self.handler(args)
 
 
+class BookLoader:
+    """Creates the address book in a background thread, see Bot.addressbook."""
+
+    def __init__(self, factory, metrics: Metrics = None):
+        # The factory should create the book with the same metrics
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.__book = None
+        self.__error = None
+        self.__thread = threading.Thread(
+            target=self.__load, args=(factory,), daemon=True
+        )
+        self.__thread.start()
+
+    def __load(self, factory):
+        try:
+            self.__book = factory()
+        except BaseException as e:
+            # exit() of a failed load is raised in the main thread
+            self.__error = e
+
+    def ready(self) -> bool:
+        return not self.__thread.is_alive()
+
+    def result(self) -> AddressBook:
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+        return self.__book
+
+
 class Bot:
     INVALID_CMD_MSG = "Invalid command!"
+    IMPORT_ERRORS_SHOWN = 10
+    OUTPUT_CHUNK_LINES = 1000
 
     HELP_MSG_HEAD = "\nThis is a CLI Bot-assistant for a phone-book.\nList of supported commands:\n"
     HELP_MSG_CMDS_FORMAT = "  {:<35} : {}"
@@ -22,10 +58,16 @@ class Bot:
         "add",
         "change",
         "phone",
+        "who",
+        "search",
         "all",
         "add-birthday",
         "show-birthday",
         "birthdays",
+        "import",
+        "export-changes",
+        "apply-changes",
+        "stats",
         "hello",
         "close",
         "exit",
@@ -35,6 +77,8 @@ class Bot:
     ]
 
     def __init__(self, addressbook: AddressBook):
+        """addressbook may be a BookLoader, then the commands which use the
+        book wait until it is loaded, the others are served at once."""
         self.cmds = defaultdict(
             lambda: Cmd("unknown_cmd", self.unknown_cmd, "", "")
         )
@@ -56,8 +100,23 @@ class Bot:
             "phone <name>",
             "Show the phone number for the specified contact.",
         )
+        self.cmds["who"] = Cmd(
+            "who",
+            self.who,
+            "who <phone>",
+            "Show the contacts which have the specified phone number.",
+        )
+        self.cmds["search"] = Cmd(
+            "search",
+            self.search,
+            "search <query>",
+            "Show contacts whose names start with or are similar to the query.",
+        )
         self.cmds["all"] = Cmd(
-            "all", self.all, "all", "Show all contacts in the address book."
+            "all",
+            self.all,
+            "all [--sorted] [--offset/--limit=N]",
+            "Show all contacts in the address book (by name with --sorted, paged with --offset=N and --limit=N).",
         )
         self.cmds["add-birthday"] = Cmd(
             "add-birthday",
@@ -77,6 +136,30 @@ class Bot:
             "birthdays",
             "Show birthdays that will occur during the next week.",
         )
+        self.cmds["import"] = Cmd(
+            "import",
+            self.import_,
+            "import <file>",
+            "Import contacts from a CSV or JSONL file (name, phones, birthday).",
+        )
+        self.cmds["export-changes"] = Cmd(
+            "export-changes",
+            self.export_changes,
+            "export-changes <since> <file>",
+            "Export changes after the position <since> (0 for all contacts) for a replica.",
+        )
+        self.cmds["apply-changes"] = Cmd(
+            "apply-changes",
+            self.apply_changes,
+            "apply-changes <file>",
+            "Apply changes exported from another address book.",
+        )
+        self.cmds["stats"] = Cmd(
+            "stats",
+            self.stats,
+            "stats [reset]",
+            "Show calls, errors and latencies of commands and saving.",
+        )
         self.cmds["hello"] = Cmd(
             "hello", self.hello, "hello", "Receive a greeting from the bot."
         )
@@ -90,9 +173,23 @@ class Bot:
         self.cmds["help"] = Cmd("help", self.help, "help", "Show this message.")
         self.cmds["h"] = Cmd("h", self.help, "h", "Show this message.")
         self.cmds["unknown_cmd"] = Cmd("unknown_cmd", self.unknown_cmd, "", "")
-        self.addressbook = addressbook
+        self.__addressbook = None
+        self.__loader = None
+        if isinstance(addressbook, BookLoader):
+            self.__loader = addressbook
+        else:
+            self.__addressbook = addressbook
+        self.metrics = addressbook.metrics
         self.finish = False
 
+    @property
+    def addressbook(self) -> AddressBook:
+        if self.__addressbook is None:
+            if not self.__loader.ready():
+                print("Loading the address book...")
+            self.__addressbook = self.__loader.result()
+        return self.__addressbook
+
     def parsing_errors(func):
         def inner(*args, **kwargs):
             try:
@@ -115,18 +212,46 @@ class Bot:
         return "\n".join(message) + "\n"
 
     def cmd_errors(func):
+        cmd_name = func.__name__.rstrip("_").replace("_", "-")
+
         def inner(*args, **kwargs):
+            __self = args[0]
+            start = perf_counter()
+            error = True
+            lazy = False
             try:
                 ret = func(*args, **kwargs)
+                error = False
+                if isinstance(ret, GeneratorType):
+                    # Timed and checked while the output is generated
+                    lazy = True
+                    return __self.lazy_output(cmd_name, ret, start)
                 return ret
             except ErrorWithMsg as e:
                 return e
             except ValueError as e:
-                __self = args[0]
-                return f"{Bot.INVALID_CMD_MSG} Expected format: {__self.cmds[func.__name__.replace('_','-')].help_short}"
+                return f"{Bot.INVALID_CMD_MSG} Expected format: {__self.cmds[cmd_name].help_short}"
+            finally:
+                if not lazy:
+                    __self.metrics.record(
+                        "cmd." + cmd_name, perf_counter() - start, error
+                    )
 
         return inner
 
+    def lazy_output(self, cmd_name, lines, start):
+        """Yield the lines, an error while they are generated ends the output."""
+        error = True
+        try:
+            yield from lines
+            error = False
+        except ErrorWithMsg as e:
+            yield str(e)
+        except Exception as e:
+            yield f"Can not show the rest of the output: {type(e).__name__}"
+        finally:
+            self.metrics.record("cmd." + cmd_name, perf_counter() - start, error)
+
     @cmd_errors
     def add(self, args):
         name, number = args
@@ -144,12 +269,36 @@ class Bot:
         (name,) = args
         return self.addressbook[name].get_phone()
 
+    @cmd_errors
+    def who(self, args):
+        (phone,) = args
+        return ", ".join(self.addressbook.find_by_phone(phone))
+
+    @cmd_errors
+    def search(self, args):
+        (query,) = args
+        names = self.addressbook.search(query)
+        return "\n".join(str(self.addressbook[name]) for name in names)
+
     @cmd_errors
     def all(self, args):
-        if len(args) > 0:
+        by_name = False
+        offset = 0
+        limit = None
+        for arg in args:
+            if arg == "--sorted":
+                by_name = True
+            elif arg.startswith("--offset="):
+                offset = int(arg.split("=", 1)[1])
+            elif arg.startswith("--limit="):
+                limit = int(arg.split("=", 1)[1])
+            else:
+                raise ValueError
+        if offset < 0 or (limit is not None and limit < 0):
             raise ValueError
-        records = [str(r) for r in self.addressbook.values()]
-        return "\n".join(records)
+        records = self.addressbook.iter_records(by_name, offset, limit)
+        # Records are formatted while they are printed
+        return (str(r) for r in records)
 
     @cmd_errors
     def add_birthday(self, args):
@@ -168,6 +317,67 @@ class Bot:
             raise ValueError
         return self.addressbook.get_birthdays_per_week()
 
+    @cmd_errors
+    def import_(self, args):
+        import importer
+
+        (filename,) = args
+        failures = []
+
+        def rows():
+            try:
+                yield from importer.read_rows(filename)
+            except importer.READ_ERRORS as e:
+                # The contacts read before the error are imported and saved
+                failures.append(e.strerror if isinstance(e, OSError) else str(e))
+
+        imported, errors = self.addressbook.import_records(rows())
+        if failures and not imported and not errors:
+            raise ErrorWithMsg(f"Can not read the file '{filename}': {failures[0]}")
+        message = [f"Imported {imported} contacts."]
+        if failures:
+            message.append(f"Can not read the rest of the file: {failures[0]}")
+        if errors:
+            message.append(f"Skipped {len(errors)} rows:")
+            for row_number, error in errors[: Bot.IMPORT_ERRORS_SHOWN]:
+                message.append(f"  row {row_number}: {error}")
+            if len(errors) > Bot.IMPORT_ERRORS_SHOWN:
+                message.append("  ...")
+        return "\n".join(message)
+
+    @cmd_errors
+    def export_changes(self, args):
+        since, filename = args
+        if self.addressbook.feed is None:
+            raise ErrorWithMsg("The change feed is disabled.")
+        try:
+            full, count, position = self.addressbook.feed.export(since, filename)
+        except OSError as e:
+            raise ErrorWithMsg(f"Can not write the file '{filename}': {e.strerror}")
+        kind = "contacts (full copy)" if full else "changes"
+        return f"Exported {count} {kind} to '{filename}'. Next time export since {position}"
+
+    @cmd_errors
+    def apply_changes(self, args):
+        import changefeed
+
+        (filename,) = args
+        try:
+            header, rows = changefeed.read_changes(filename)
+        except OSError as e:
+            raise ErrorWithMsg(f"Can not read the file '{filename}': {e.strerror}")
+        applied = self.addressbook.apply_changes(rows)
+        return f"Applied {applied} changes, the source was at {header['feed']}."
+
+    @cmd_errors
+    def stats(self, args):
+        if args == ["reset"]:
+            self.metrics.reset()
+            return "Statistics reset."
+        if len(args) > 0:
+            raise ValueError
+        return self.metrics.report()
+
     @cmd_errors
     def hello(self, args):
         if len(args) > 0:
@@ -178,7 +388,7 @@ class Bot:
     def close(self, args):
         if len(args) > 0:
             raise ValueError
-        self.addressbook.dump_to_file()
+        self.addressbook.close()
         self.finish = True
         return "Good bye!"
 
@@ -198,9 +408,64 @@ class Bot:
         cmd, *args = user_input.split()
         return cmd.strip().lower(), args
 
+    def execute(self, cmd, args):
+        """Dispatch a parsed command, the whole call is measured as 'dispatch'."""
+        with self.metrics.timer("dispatch"):
+            return self.cmds[cmd](args)
+
+    def print_result(self, result):
+        if isinstance(result, (str, Exception)):
+            print(result)
+            return
+        # Long outputs are generated lazily and written in chunks
+        chunk = []
+        for line in result:
+            chunk.append(line)
+            if len(chunk) >= Bot.OUTPUT_CHUNK_LINES:
+                sys.stdout.write("\n".join(chunk) + "\n")
+                chunk.clear()
+        if chunk:
+            sys.stdout.write("\n".join(chunk) + "\n")
+        sys.stdout.flush()
+
+    def batch_result(self, line_number, cmd, result):
+        ok = not isinstance(result, Exception)
+        if isinstance(result, str):
+            ok = not result.startswith(Bot.INVALID_CMD_MSG)
+        elif ok:
+            result = list(result)
+        else:
+            result = str(result)
+        return {"line": line_number, "cmd": cmd, "ok": ok, "result": result}
+
+    def run_batch(self, lines, flush_every: int = None, output=sys.stdout):
+        """Execute commands without prompts and write a JSON result per command.
+
+        The address book is saved every flush_every commands and at the end.
+        """
+        import json
+
+        self.addressbook.defer_saving()
+        executed = 0
+        for line_number, line in enumerate(lines, 1):
+            cmd, *args = line.split() or ("",)
+            if not cmd or cmd.startswith("#"):
+                continue
+            cmd = cmd.lower()
+            result = self.execute(cmd, args)
+            output.write(
+                json.dumps(self.batch_result(line_number, cmd, result)) + "\n"
+            )
+            if self.finish:
+                return
+            executed += 1
+            if flush_every and executed % flush_every == 0:
+                self.addressbook.dump_to_file()
+        self.addressbook.close()
+
     def run(self):
         print("Welcome to the assistant bot!")
         while not self.finish:
             cmd, args = self.get_input("Enter a command: ")
-            print(self.cmds[cmd](args))
+            self.print_result(self.execute(cmd, args))
 
@@ -0,0 +1,172 @@
+from collections import deque
+from datetime import date
+import json
+import os
+from uuid import uuid4
+
+from addressbook import Birthday, ErrorWithMsg, Phone
+
+
+class ChangeFeed:
+    """Numbered changes of an address book for incremental replication.
+
+    Every change of the book gets the next sequence number. A position is
+    "<feed id>:<sequence>", the id is new unless the feed of the last run
+    is loaded (see save()), so a position of another feed (or older than
+    the kept changes) means that a full copy of the book has to be
+    exported instead of the changes.
+    """
+
+    def __init__(self, book, size: int = 10000):
+        self.book = book
+        self.id = uuid4().hex[:12]
+        self.sequence = 0
+        # (sequence, op, name, (phones, birthday) for "put")
+        self.__entries = deque(maxlen=size)
+        book.add_listener(self.__changed)
+
+    def save(self, filename: str):
+        """Write the id, the sequence and the kept changes to a JSON file.
+
+        Must be called under the book lock, when the book is saved.
+        """
+        entries = [
+            [sequence, op, name, *(state or (None, None))]
+            for sequence, op, name, state in self.__entries
+        ]
+        for entry in entries:
+            if entry[4] is not None:
+                entry[4] = entry[4].isoformat()
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as fd:
+            json.dump(
+                {"id": self.id, "sequence": self.sequence, "entries": entries},
+                fd,
+            )
+        os.replace(tmp_filename, filename)
+
+    def load(self, filename: str) -> bool:
+        """Continue the feed written by save(), return False if there is none.
+
+        The file is removed: if the book is not closed properly, the changes
+        made meanwhile are not in the file, so the next run starts a new feed.
+        """
+        try:
+            with open(filename, "r", encoding="utf-8") as fd:
+                state = json.load(fd)
+            os.remove(filename)
+            entries = deque(maxlen=self.__entries.maxlen)
+            for sequence, op, name, phones, birthday in state["entries"]:
+                if birthday is not None:
+                    birthday = date.fromisoformat(birthday)
+                entries.append(
+                    (sequence, op, name, (phones, birthday) if op == "put" else None)
+                )
+            self.id, self.sequence = state["id"], state["sequence"]
+            self.__entries = entries
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError):
+            print(f"Change feed '{filename}' is damaged, a new one is started")
+            if os.path.isfile(filename):
+                os.remove(filename)
+            return False
+        return True
+
+    @property
+    def position(self) -> str:
+        return f"{self.id}:{self.sequence}"
+
+    def __changed(self, op, name, record):
+        # Called under the book lock, so the numbers follow the changes
+        self.sequence += 1
+        state = None
+        if op == "put":
+            state = (record.phones.tolist(), record.birthday)
+        self.__entries.append((self.sequence, op, name, state))
+
+    def __since(self, position: str):
+        # The sequence to export the changes after, or None for a full copy
+        feed_id, _, sequence = (position or "").partition(":")
+        if feed_id != self.id or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        first = self.__entries[0][0] if self.__entries else self.sequence + 1
+        if sequence > self.sequence or sequence < first - 1:
+            return None
+        return sequence
+
+    @staticmethod
+    def row(op, name=None, phones=(), birthday=None) -> dict:
+        if op == "clear":
+            return {"op": op}
+        if op == "del":
+            return {"op": op, "name": name}
+        return {
+            "op": op,
+            "name": name,
+            "phones": [Phone.format(phone) for phone in phones],
+            "birthday": Birthday.format(birthday) if birthday else None,
+        }
+
+    def changes(self, position: str):
+        """Return (full, rows, new position) of the changes after the position.
+
+        Only the last change of every contact is returned.
+        """
+        with self.book.read_lock:
+            since = self.__since(position)
+            if since is None:
+                rows = [ChangeFeed.row("clear")]
+                for record in self.book.data.values():
+                    rows.append(
+                        ChangeFeed.row(
+                            "put",
+                            record.get_name(),
+                            record.phones,
+                            record.birthday,
+                        )
+                    )
+                return True, rows, self.position
+            cleared = False
+            last = {}
+            for sequence, op, name, state in self.__entries:
+                if sequence <= since:
+                    continue
+                if op == "clear":
+                    cleared = True
+                    last.clear()
+                    continue
+                # Moved to the end, the order of the changes is kept
+                last.pop(name, None)
+                last[name] = ChangeFeed.row(op, name, *(state or ()))
+            rows = [ChangeFeed.row("clear")] if cleared else []
+            rows.extend(last.values())
+            return False, rows, self.position
+
+    def export(self, position: str, filename: str):
+        """Write the changes after the position to a JSONL file.
+
+        Returns (full, number of changes or contacts, new position).
+        """
+        full, rows, new_position = self.changes(position)
+        header = {"feed": new_position, "since": position, "full": full}
+        with open(filename, "w", encoding="utf-8") as fd:
+            fd.write(json.dumps(header) + "\n")
+            for row in rows:
+                fd.write(json.dumps(row) + "\n")
+        # A full copy starts with "clear"
+        return full, len(rows) - full, new_position
+
+
+def read_changes(filename: str):
+    """Return (header, rows) of a file written by ChangeFeed.export()."""
+    with open(filename, "r", encoding="utf-8") as fd:
+        try:
+            header = json.loads(fd.readline())
+            rows = [json.loads(line) for line in fd if line.strip()]
+        except ValueError:
+            raise ErrorWithMsg(f"'{filename}' is not a changes file.")
+    if not isinstance(header, dict) or "feed" not in header:
+        raise ErrorWithMsg(f"'{filename}' is not a changes file.")
+    return header, rows
@@ -0,0 +1,39 @@
+def parse_args(
+    args,
+    options: dict,
+    usage: str,
+    flags: dict = None,
+    types: dict = None,
+    positional: bool = False,
+) -> list:
+    """Parse the '--name=value' options of a command line tool into options.
+
+    options maps the names to the defaults and is updated in place, a value
+    is converted by types[name] (str by default). flags maps the names which
+    may be given without a value to the value they set, a flag which sets
+    True takes no value at all. -h, --help and, unless positional is set,
+    any argument without '--' print the usage and exit.
+    Returns the positional arguments, a wrong option exits with an error.
+    """
+    flags = flags or {}
+    types = types or {}
+    rest = []
+    for arg in args:
+        name, _, value = arg[2:].partition("=")
+        if arg in ("-h", "--help") or not (positional or arg.startswith("--")):
+            print(usage)
+            exit()
+        elif not arg.startswith("--"):
+            rest.append(arg)
+        elif name in flags and arg == "--" + name:
+            options[name] = flags[name]
+        elif name in options and value and flags.get(name) is not True:
+            try:
+                options[name] = types.get(name, str)(value)
+            except ValueError:
+                print("Error to parse args:", arg)
+                exit(1)
+        else:
+            print("Error to parse args:", arg)
+            exit(1)
+    return rest
@@ -0,0 +1,43 @@
+import csv
+import json
+
+from addressbook import ErrorWithMsg
+
+# Errors of a file which can not be read (further)
+READ_ERRORS = (OSError, ValueError, csv.Error)
+
+
+def read_rows(filename: str):
+    """Yield contacts from a CSV or JSONL file as dicts, one by one.
+
+    CSV files must have a header with name, phones and birthday columns
+    (several phones are separated by ';'). JSONL files have one object
+    with the same keys per line. None is yielded for a row which can not be parsed.
+    """
+    if filename.endswith(".csv"):
+        yield from read_csv(filename)
+    elif filename.endswith((".jsonl", ".json")):
+        yield from read_jsonl(filename)
+    else:
+        raise ErrorWithMsg("Unknown file format (expecting .csv or .jsonl)")
+
+
+def read_csv(filename: str):
+    with open(filename, "r", newline="", encoding="utf-8") as fd:
+        for row in csv.DictReader(fd):
+            phones = row.get("phones")
+            if phones:
+                row["phones"] = phones.split(";")
+            yield row
+
+
+def read_jsonl(filename: str):
+    with open(filename, "r", encoding="utf-8") as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
@@ -0,0 +1,147 @@
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+import os
+import pickle
+import struct
+import threading
+
+
+class IndexedRecords(MutableMapping):
+    """Records of an address book stored in the indexed file format.
+
+    The file header points to an index of record offsets (and the phone and
+    birthday indexes of the book), only the index is read on start.
+    Records are unpickled on the first access and cached.
+    """
+
+    MAGIC = b"ABOOK-IDX-1\n"
+    HEADER = struct.Struct("<Q")
+
+    def __init__(self, filename: str, book=None):
+        self.filename = filename
+        self.book = book
+        self.phone_index = None
+        self.birthday_index = None
+        # name -> Record if it is loaded or (offset, length) in the file
+        self.__entries = {}
+        self.__fd = None
+        self.__fd_lock = threading.Lock()
+        if os.path.isfile(filename):
+            self.__open(filename)
+
+    def __open(self, filename):
+        fd = open(filename, "rb")
+        if fd.read(len(self.MAGIC)) != self.MAGIC:
+            fd.close()
+            raise ValueError("Not an indexed addressbook file")
+        (index_offset,) = self.HEADER.unpack(fd.read(self.HEADER.size))
+        fd.seek(index_offset)
+        self.__entries = pickle.load(fd)
+        self.phone_index = pickle.load(fd)
+        self.birthday_index = pickle.load(fd)
+        self.__fd = fd
+
+    def __load(self, name):
+        with self.__fd_lock:
+            # Read again, write() may have moved the offsets to a new file
+            location = self.__entries[name]
+            if type(location) is not tuple:
+                # Loaded by another thread in the meantime
+                return location
+            offset, length = location
+            self.__fd.seek(offset)
+            record = pickle.loads(self.__fd.read(length))
+            if self.__entries.get(name) is not location:
+                # Changed by another thread in the meantime
+                return self.__entries[name]
+            record.attach(self.book)
+            self.__entries[name] = record
+        return record
+
+    def __getitem__(self, name):
+        entry = self.__entries[name]
+        if type(entry) is tuple:
+            return self.__load(name)
+        return entry
+
+    def __setitem__(self, name, record):
+        self.__entries[name] = record
+
+    def __delitem__(self, name):
+        del self.__entries[name]
+
+    def __contains__(self, name):
+        return name in self.__entries
+
+    def __iter__(self):
+        return iter(self.__entries)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def values(self):
+        for name in list(self.__entries):
+            try:
+                yield self[name]
+            except KeyError:
+                # Deleted while iterating
+                continue
+
+    def clear(self):
+        self.__entries.clear()
+
+    def snapshot(self, phone_index, birthday_index):
+        """Must be called under the book lock, the result is passed to write()."""
+        records = []
+        for name, entry in self.__entries.items():
+            if type(entry) is tuple:
+                # Not loaded records are copied as is
+                records.append((name, entry))
+            else:
+                records.append((name, pickle.dumps(entry)))
+        indexes = pickle.dumps(phone_index), pickle.dumps(birthday_index)
+        return records, indexes
+
+    def write(self, snapshot):
+        records, (phone_index, birthday_index) = snapshot
+        locations = {}
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "wb") as fd:
+            fd.write(self.MAGIC)
+            fd.write(self.HEADER.pack(0))
+            for name, data in records:
+                if type(data) is tuple:
+                    offset, length = data
+                    with self.__fd_lock:
+                        self.__fd.seek(offset)
+                        data = self.__fd.read(length)
+                locations[name] = (fd.tell(), len(data))
+                fd.write(data)
+            index_offset = fd.tell()
+            pickle.dump(locations, fd)
+            fd.write(phone_index)
+            fd.write(birthday_index)
+            fd.seek(len(self.MAGIC))
+            fd.write(self.HEADER.pack(index_offset))
+            # Must be on disk before the journal is truncated
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_filename, self.filename)
+        new_fd = open(self.filename, "rb")
+        # The file and the offsets are switched at once, changes of the
+        # book wait, so the records added or deleted meanwhile are kept
+        book_lock = self.book.lock if self.book is not None else nullcontext()
+        with book_lock, self.__fd_lock:
+            if self.__fd:
+                self.__fd.close()
+            self.__fd = new_fd
+            # Records loaded or changed after the snapshot stay as they are
+            for name, entry in list(self.__entries.items()):
+                if type(entry) is tuple:
+                    self.__entries[name] = locations[name]
+
+    def close(self):
+        with self.__fd_lock:
+            if self.__fd:
+                self.__fd.close()
+                self.__fd = None
@@ -0,0 +1,143 @@
+from datetime import date
+import json
+import os
+import sys
+
+from addressbook import AddressBook, Birthday, ErrorWithMsg, Phone, Record
+
+# One encoder for all the lines, json.dumps() creates a new one for options
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def snapshot(records) -> list:
+    """Must be called under the book lock, the result is passed to write().
+
+    Only the values are copied, they are formatted outside the lock.
+    """
+    return [
+        (record.get_name(), record.phones.tolist(), record.birthday)
+        for record in records
+    ]
+
+
+def write(filename: str, snapshot: list):
+    """Write a record per line, the file is replaced only when it is complete."""
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as fd:
+        for name, phones, birthday in snapshot:
+            row = {
+                "name": name,
+                "phones": [Phone.format(phone) for phone in phones],
+                "birthday": Birthday.format(birthday) if birthday else None,
+            }
+            fd.write(_encoder.encode(row))
+            fd.write("\n")
+        # Must be on disk before the journal is truncated
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def _record(row) -> Record:
+    # The rows of write() are checked here without the Field objects,
+    # anything else is validated by Record.from_dict()
+    try:
+        name = row["name"]
+        phones = row["phones"]
+        birthday = row["birthday"]
+        if (
+            type(name) is str
+            and name
+            and name == name.strip()
+            and type(phones) is list
+            and all(
+                type(phone) is str and len(phone) == 10 and phone.isdigit()
+                for phone in phones
+            )
+        ):
+            if birthday is not None:
+                day, month, year = birthday.split(".")
+                if len(day) != 2 or len(month) != 2 or len(year) != 4:
+                    raise ValueError
+                birthday = date(int(year), int(month), int(day))
+            return Record.from_values(name, map(int, phones), birthday)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+    return Record.from_dict(row)
+
+
+def read(filename: str):
+    """Yield the records of a file written by write(), one by one.
+
+    The lines are the rows of Record.from_dict(), so the file can be
+    imported by the 'import' command as well. ValueError is raised with
+    the line number for a line which is not a valid record or repeats
+    a name.
+    """
+    names = set()
+    with open(filename, "r", encoding="utf-8") as fd:
+        for line_number, line in enumerate(fd, 1):
+            if not line.strip():
+                continue
+            try:
+                record = _record(json.loads(line))
+            except ErrorWithMsg as e:
+                raise ValueError(f"line {line_number}: {e}")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(f"line {line_number}: invalid record")
+            name = record.get_name()
+            if name in names:
+                raise ValueError(
+                    f"line {line_number}: Contact '{name}' already exists."
+                )
+            names.add(name)
+            yield record
+
+
+def convert(source: str, target: str) -> int:
+    """Write a book of any format (with its journal) to a JSON Lines file.
+
+    Returns the number of the records. The source is only read: the journal
+    is replayed without compaction and the book is not saved.
+    """
+    book = AddressBook(source, compact_threshold=float("inf"))
+    book.load_from_journal(repair=False)
+    with book.read_lock:
+        records = snapshot(book.data.values())
+    # close() would save the book, only its files and its feed are saved
+    book.save_feed()
+    if hasattr(book.data, "close"):
+        book.data.close()
+    write(target, records)
+    return len(records)
+
+
+if __name__ == "__main__":
+    __usage_help_message = """
+    Usage:
+        python ./jsonbook.py <source book> <target.jsonl>
+
+        Converts an address book (a pickle book by default) to the JSON Lines
+        format, the source book is not changed.
+
+        -h, --help:         Show this message
+
+    Example:
+        $python ./jsonbook.py my_book.bin my_book.jsonl
+    """
+
+    if len(sys.argv) != 3 or AddressBook.storage_format(sys.argv[2]) != "json":
+        print(__usage_help_message)
+        exit()
+    source, target = sys.argv[1:]
+    # A book is only a journal until its first compaction
+    journal = source + AddressBook.JOURNAL_SUFFIX
+    if not os.path.exists(source) and not os.path.exists(journal):
+        print(f"The book '{source}' does not exist")
+        exit(1)
+    try:
+        count = convert(source, target)
+    except OSError as e:
+        print(f"Can not write the file '{target}':", e.strerror)
+        exit(1)
+    print(f"{count} contacts are written to '{target}'.")
@@ -1,13 +1,136 @@
-from bot import Bot
+import sys
+
+import cliargs
+from bot import Bot, BookLoader
 from addressbook import AddressBook
+from metrics import Metrics
+
+USAGE = """
+    Usage:
+        python ./main.py [--batch] [<commands_file>] [--book=<file>] [--flush-every=<N>]
+                         [--metrics=<file>] [--metrics-interval=<seconds>]
+                         [--profile=<dir>] [--profile-rate=<rate>] [--profile-memory]
+
+        --batch:            Run commands from <commands_file> or stdin without prompts,
+                            a JSON line with the result is printed for each command
+                            (used by default if stdin is not a terminal)
+        --book=<file>:      Address book file, default is my_book.bin
+        --flush-every=<N>:  Save the address book every <N> commands in batch mode,
+                            by default it is saved once at the end
+        --metrics=<file>:   Write the statistics of the 'stats' command to a JSON file
+                            periodically and at exit
+        --metrics-interval=<seconds>:
+                            How often the metrics file is written, default is 60
+        --profile=<dir>:    Profile loading of the book and the commands with cProfile,
+                            the reports of the session are written to <dir> at exit
+        --profile-rate=<rate>:
+                            Share of the commands to profile, from 0 to 1, default is 1
+        --profile-memory:   Trace the allocations of the profiled calls with tracemalloc
+        -h, --help:         Show this message
+"""
+
+# Options with a value and the functions which convert them
+OPTIONS = {
+    "book": str,
+    "flush-every": int,
+    "metrics": str,
+    "metrics-interval": float,
+    "profile": str,
+    "profile-rate": float,
+}
+
+
+def parse_args(args):
+    options = {
+        "batch": not sys.stdin.isatty(),
+        "book": "my_book.bin",
+        "flush-every": None,
+        "metrics": None,
+        "metrics-interval": 60.0,
+        "profile": None,
+        "profile-rate": 1.0,
+        "profile-memory": False,
+    }
+    commands_files = cliargs.parse_args(
+        args,
+        options,
+        USAGE,
+        flags={"batch": True, "profile-memory": True},
+        types=OPTIONS,
+        positional=True,
+    )
+    options["commands_file"] = None
+    if commands_files:
+        options["batch"] = True
+        options["commands_file"] = commands_files[-1]
+    if not 0 <= options["profile-rate"] <= 1:
+        print("Error to parse args: --profile-rate must be from 0 to 1")
+        exit(1)
+    return options
 
 
 def main():
-    address_book = AddressBook("my_book.bin")
+    options = parse_args(sys.argv[1:])
+    metrics = Metrics()
+    if options["metrics"]:
+        metrics.start_dump(options["metrics"], options["metrics-interval"])
+    profiler = None
+    if options["profile"]:
+        from profiler import Profiler
+
+        profiler = Profiler(
+            options["profile"],
+            options["profile-rate"],
+            options["profile-memory"],
+        )
+    try:
+        run(options, metrics, profiler)
+    finally:
+        metrics.stop_dump()
+        if profiler is not None:
+            # stdout is for the results in batch mode
+            print(
+                "Profile reports:",
+                ", ".join(profiler.write_reports()),
+                file=sys.stderr,
+            )
+
+
+def run(options, metrics, profiler=None):
+    book = options["book"]
+    book_options = {"journal": True, "metrics": metrics}
+    if not options["batch"]:
+        book_options["write_behind"] = True
+    if profiler is None and not options["batch"]:
+        # The prompt is shown while the book is loaded
+        address_book = BookLoader(
+            lambda: AddressBook(book, **book_options), metrics
+        )
+    elif profiler is None:
+        address_book = AddressBook(book, **book_options)
+    else:
+        # Loading is always profiled, a big book is the usual suspect
+        address_book = profiler.call(
+            "load", AddressBook, book, sample=True, **book_options
+        )
     bot = Bot(address_book)
-    bot.run()
+    if profiler is not None:
+        profiler.wrap_handlers(bot.cmds)
+    if not options["batch"]:
+        bot.run()
+        return
+    commands_file = options["commands_file"]
+    flush_every = options["flush-every"]
+    if commands_file is None:
+        bot.run_batch(sys.stdin, flush_every)
+        return
+    try:
+        with open(commands_file, "r") as fd:
+            bot.run_batch(fd, flush_every)
+    except OSError as e:
+        print(f"Can not read the file '{commands_file}':", e.strerror)
+        exit(1)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,149 @@
+import os
+import threading
+from time import perf_counter
+
+
+class Metrics:
+    """Call counts, error counts and latency histograms by name.
+
+    A histogram has a bucket per power of two microseconds, so recording
+    a call is a few integer operations under a lock.
+    """
+
+    BUCKETS = 40
+    REPORT_HEAD = "{:<24} {:>8} {:>7} {:>11} {:>11} {:>11} {:>11} {:>11}".format(
+        "name", "calls", "errors", "mean us", "p50 us", "p95 us", "p99 us", "max us"
+    )
+    REPORT_FORMAT = "{:<24} {:>8} {:>7} {:>11.1f} {:>11} {:>11} {:>11} {:>11.1f}"
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # name -> [calls, errors, total seconds, max seconds, buckets]
+        self.__stats = {}
+        self.__dump_stop = None
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        bucket = min(int(seconds * 1e6).bit_length(), Metrics.BUCKETS - 1)
+        with self.__lock:
+            stats = self.__stats.get(name)
+            if stats is None:
+                stats = self.__stats[name] = [0, 0, 0.0, 0.0, [0] * Metrics.BUCKETS]
+            stats[0] += 1
+            stats[1] += error
+            stats[2] += seconds
+            if seconds > stats[3]:
+                stats[3] = seconds
+            stats[4][bucket] += 1
+
+    def timer(self, name: str):
+        """Context manager which records the time of the block, an exception is an error."""
+        return _Timer(self, name)
+
+    @staticmethod
+    def percentile(buckets: list, calls: int, p: float) -> int:
+        # The upper bound of the bucket, in microseconds
+        rank = calls * p / 100
+        seen = 0
+        for i, count in enumerate(buckets):
+            seen += count
+            if seen >= rank:
+                return 1 << i
+        return 1 << (len(buckets) - 1)
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            items = [
+                (name, stats[:4] + [stats[4][:]])
+                for name, stats in self.__stats.items()
+            ]
+        result = {}
+        for name, (calls, errors, total, maximum, buckets) in sorted(items):
+            maximum = round(maximum * 1e6, 1)
+            result[name] = {
+                "calls": calls,
+                "errors": errors,
+                "total_s": round(total, 6),
+                "mean_us": round(total / calls * 1e6, 1),
+                "p50_us": min(self.percentile(buckets, calls, 50), maximum),
+                "p95_us": min(self.percentile(buckets, calls, 95), maximum),
+                "p99_us": min(self.percentile(buckets, calls, 99), maximum),
+                "max_us": maximum,
+            }
+        return result
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
+
+    def report(self) -> str:
+        stats = self.snapshot()
+        if not stats:
+            return "No statistics yet."
+        lines = [Metrics.REPORT_HEAD]
+        for name, s in stats.items():
+            lines.append(
+                Metrics.REPORT_FORMAT.format(
+                    name,
+                    s["calls"],
+                    s["errors"],
+                    s["mean_us"],
+                    s["p50_us"],
+                    s["p95_us"],
+                    s["p99_us"],
+                    s["max_us"],
+                )
+            )
+        return "\n".join(lines)
+
+    def dump(self, filename: str):
+        import json
+
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as fd:
+            json.dump(self.snapshot(), fd, indent=2)
+        os.replace(tmp_filename, filename)
+
+    def start_dump(self, filename: str, interval: float = 60.0):
+        """Dump the metrics to the file every interval seconds and on stop_dump()."""
+
+        def dump_loop():
+            while True:
+                stopped = stop.wait(interval)
+                try:
+                    self.dump(filename)
+                except OSError as e:
+                    print(
+                        f"Can not write metrics to the file '{filename}':",
+                        e.strerror,
+                    )
+                if stopped:
+                    return
+
+        stop = threading.Event()
+        thread = threading.Thread(target=dump_loop, daemon=True)
+        self.__dump_stop = (stop, thread)
+        thread.start()
+
+    def stop_dump(self):
+        if self.__dump_stop is not None:
+            stop, thread = self.__dump_stop
+            self.__dump_stop = None
+            stop.set()
+            thread.join()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.metrics.record(
+            self.name, perf_counter() - self.start, exc_type is not None
+        )
@@ -0,0 +1,127 @@
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+from types import GeneratorType
+
+
+class Profiler:
+    """Samples calls with cProfile and, optionally, tracemalloc.
+
+    rate is the share of calls to profile: 1 profiles every call, 0.01 one
+    call of a hundred, so the overhead is bounded when it is left on.
+    All the samples of a session are collected in one profile, reports are
+    written to the directory by write_reports().
+    """
+
+    TOP_LINES = 30
+    TOP_ALLOCATIONS = 20
+
+    def __init__(self, directory: str, rate: float = 1.0, memory: bool = False):
+        self.directory = directory
+        self.rate = rate
+        self.memory = memory
+        self.profile = cProfile.Profile()
+        self.session = datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        # name -> [calls, sampled calls, peak bytes]
+        self.calls = {}
+        # "file:line" -> allocated bytes still alive at the end of the samples
+        self.allocations = {}
+        self.__credit = 0.0
+        self.__active = False
+
+    def __sample(self) -> bool:
+        # Every 1/rate-th call is sampled, without a random generator
+        self.__credit += self.rate
+        if self.__credit < 1 or self.__active:
+            return False
+        self.__credit -= 1
+        return True
+
+    def call(self, name: str, func, *args, sample: bool = None, **kwargs):
+        """Call func, profile it if it is sampled (or sample is True)."""
+        stats = self.calls.setdefault(name, [0, 0, 0])
+        stats[0] += 1
+        if sample is None:
+            sample = self.__sample()
+        if not sample:
+            return func(*args, **kwargs)
+        stats[1] += 1
+        self.__active = True
+        if self.memory:
+            tracemalloc.start()
+        self.profile.enable()
+        try:
+            ret = func(*args, **kwargs)
+            if isinstance(ret, GeneratorType):
+                # Lazy output is generated here to be profiled as well
+                ret = list(ret)
+        finally:
+            self.profile.disable()
+            if self.memory:
+                self.__take_allocations(stats)
+                tracemalloc.stop()
+            self.__active = False
+        return ret
+
+    def __take_allocations(self, stats):
+        stats[2] = max(stats[2], tracemalloc.get_traced_memory()[1])
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        for stat in snapshot.statistics("lineno"):
+            frame = stat.traceback[0]
+            key = f"{frame.filename}:{frame.lineno}"
+            self.allocations[key] = self.allocations.get(key, 0) + stat.size
+
+    def wrap_handlers(self, cmds):
+        """Profile the handlers of the bot commands (Bot.cmds)."""
+        for cmd in set(cmds.values()):
+            cmd.handler = self.__wrap(cmd.name, cmd.handler)
+
+    def __wrap(self, name, handler):
+        def inner(args):
+            return self.call(name, handler, args)
+
+        return inner
+
+    def write_reports(self) -> list:
+        """Write the profile and the text reports, return their file names."""
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"profile-{self.session}")
+        filenames = [base + ".prof", base + ".txt"]
+        # The .prof file is for pstats, snakeviz and similar tools
+        self.profile.dump_stats(filenames[0])
+        with open(filenames[1], "w") as fd:
+            fd.write(f"Sampling rate: {self.rate}\n\n")
+            fd.write(f"{'name':<20} {'calls':>8} {'sampled':>8}\n")
+            for name, (calls, sampled, _) in sorted(self.calls.items()):
+                fd.write(f"{name:<20} {calls:>8} {sampled:>8}\n")
+            fd.write("\n")
+            fd.write(self.__stats_text())
+        if self.memory:
+            filenames.append(base + ".alloc.txt")
+            with open(filenames[2], "w") as fd:
+                fd.write(f"{'name':<20} {'peak KiB':>10}\n")
+                for name, (_, sampled, peak) in sorted(self.calls.items()):
+                    if sampled:
+                        fd.write(f"{name:<20} {peak // 1024:>10}\n")
+                fd.write("\nAllocations alive at the end of the sampled calls:\n")
+                top = sorted(
+                    self.allocations.items(), key=lambda item: -item[1]
+                )[: Profiler.TOP_ALLOCATIONS]
+                for where, size in top:
+                    fd.write(f"{size // 1024:>10} KiB  {where}\n")
+        return filenames
+
+    def __stats_text(self) -> str:
+        out = io.StringIO()
+        try:
+            stats = pstats.Stats(self.profile, stream=out)
+        except TypeError:
+            # Nothing has been sampled
+            return "No calls were sampled.\n"
+        stats.sort_stats("cumulative").print_stats(Profiler.TOP_LINES)
+        return out.getvalue()
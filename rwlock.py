@@ -0,0 +1,80 @@
+import threading
+
+
+class RWLock:
+    """Reader-writer lock: many readers or one writer, waiting writers go first.
+
+    Both sides are reentrant and the writer may take the read lock as well,
+    but a reader can not be upgraded to a writer.
+    Used as a context manager it is the write lock, `reader` is the read lock.
+    """
+
+    def __init__(self):
+        self.__cond = threading.Condition(threading.Lock())
+        self.__readers = {}
+        self.__writer = None
+        self.__writer_depth = 0
+        self.__waiting_writers = 0
+        self.reader = _ReadLock(self)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer == me or me in self.__readers:
+                self.__readers[me] = self.__readers.get(me, 0) + 1
+                return
+            while self.__writer is not None or self.__waiting_writers:
+                self.__cond.wait()
+            self.__readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self.__cond:
+            depth = self.__readers[me] - 1
+            if depth:
+                self.__readers[me] = depth
+                return
+            del self.__readers[me]
+            if not self.__readers:
+                self.__cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__writer == me:
+                self.__writer_depth += 1
+                return
+            if me in self.__readers:
+                raise RuntimeError("Can not upgrade a read lock")
+            self.__waiting_writers += 1
+            while self.__writer is not None or self.__readers:
+                self.__cond.wait()
+            self.__waiting_writers -= 1
+            self.__writer = me
+            self.__writer_depth = 1
+
+    def release_write(self):
+        with self.__cond:
+            self.__writer_depth -= 1
+            if self.__writer_depth == 0:
+                self.__writer = None
+                self.__cond.notify_all()
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, *exc):
+        self.release_write()
+
+
+class _ReadLock:
+    def __init__(self, lock: RWLock):
+        self.__lock = lock
+
+    def __enter__(self):
+        self.__lock.acquire_read()
+        return self
+
+    def __exit__(self, *exc):
+        self.__lock.release_read()
@@ -0,0 +1,205 @@
+import sys
+import threading
+from calendar import isleap
+from datetime import datetime, date, time, timedelta
+from heapq import heapify, heappop, heappush
+
+import cliargs
+from addressbook import AddressBook
+
+
+def congratulation_day(birthday: date, year: int) -> date:
+    """The day of the year when the birthday is congratulated.
+
+    The same rules as in birthdays.get_birthdays_per_week: 29-Feb is
+    celebrated at 28-Feb in non leap years, weekends move to Monday.
+    """
+    if birthday.month == 2 and birthday.day == 29 and not isleap(year):
+        day = date(year, 2, 28)
+    else:
+        day = birthday.replace(year=year)
+    if day.weekday() > 4:
+        day += timedelta(days=7 - day.weekday())
+    return day
+
+
+def next_congratulation(birthday: date, after: datetime, at: time) -> datetime:
+    # A weekend at the end of the last year may move to this year
+    for year in range(after.year - 1, after.year + 2):
+        when = datetime.combine(congratulation_day(birthday, year), at)
+        if when > after:
+            return when
+
+
+class PrintSink:
+    """Writes a line per notification to a stream, stdout by default."""
+
+    FORMAT = "{when:%Y-%m-%d %H:%M}: Congratulate {name} (birthday {birthday:%d.%m.%Y})\n"
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def __call__(self, when: datetime, name: str, birthday: date):
+        stream = self.stream or sys.stdout
+        stream.write(self.FORMAT.format(when=when, name=name, birthday=birthday))
+        stream.flush()
+
+
+class FileSink(PrintSink):
+    """Appends a line per notification to a file."""
+
+    def __init__(self, filename: str):
+        super().__init__(open(filename, "a"))
+
+    def close(self):
+        self.stream.close()
+
+
+class BirthdayScheduler:
+    """Emits a notification at the congratulation time of every birthday.
+
+    The next congratulation of every contact is kept in a min-heap, so the
+    scheduler sleeps until the first one and every event or change of the
+    book costs O(log N). Changed contacts are pushed again, their old heap
+    entries are skipped when they are popped.
+    """
+
+    # Wake up at least that often, the system clock may be changed
+    MAX_SLEEP = 3600.0
+
+    def __init__(self, book: AddressBook, sink=None, at: time = time(9, 0), clock=None):
+        self.book = book
+        self.sink = sink or PrintSink()
+        self.at = at
+        self.clock = clock or datetime.now
+        self.__cond = threading.Condition()
+        # (when, name) of all the pushed entries, some of them are stale
+        self.__heap = []
+        # name -> (when, birthday) of the current entries
+        self.__entries = {}
+        self.__stopped = False
+        self.__thread = None
+        # Changes wait until the heap is built
+        with book.lock:
+            book.add_listener(self.__changed)
+            now = self.clock()
+            with self.__cond:
+                for record in book.data.values():
+                    if record.birthday:
+                        when = next_congratulation(record.birthday, now, at)
+                        self.__entries[record.get_name()] = (when, record.birthday)
+                self.__heap = [(when, name) for name, (when, _) in self.__entries.items()]
+                heapify(self.__heap)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __changed(self, op, name, record):
+        # Called under the book lock
+        with self.__cond:
+            if op == "clear":
+                self.__entries.clear()
+                self.__heap.clear()
+            elif op == "del" or not record.birthday:
+                self.__entries.pop(name, None)
+            else:
+                entry = self.__entries.get(name)
+                if entry is not None and entry[1] == record.birthday:
+                    return
+                when = next_congratulation(record.birthday, self.clock(), self.at)
+                self.__entries[name] = (when, record.birthday)
+                heappush(self.__heap, (when, name))
+            self.__cond.notify()
+
+    def __pop_due(self, now: datetime) -> list:
+        due = []
+        while self.__heap and self.__heap[0][0] <= now:
+            when, name = heappop(self.__heap)
+            entry = self.__entries.get(name)
+            if entry is None or entry[0] != when:
+                # Deleted or changed after it was pushed
+                continue
+            birthday = entry[1]
+            due.append((when, name, birthday))
+            when = next_congratulation(birthday, when, self.at)
+            self.__entries[name] = (when, birthday)
+            heappush(self.__heap, (when, name))
+        return due
+
+    def __timeout(self, now: datetime) -> float:
+        if not self.__heap:
+            return self.MAX_SLEEP
+        seconds = (self.__heap[0][0] - now).total_seconds()
+        return min(max(seconds, 0), self.MAX_SLEEP)
+
+    def next_due(self):
+        """Return (when, name) of the next notification or None."""
+        with self.__cond:
+            while self.__heap:
+                when, name = self.__heap[0]
+                entry = self.__entries.get(name)
+                if entry is not None and entry[0] == when:
+                    return when, name
+                heappop(self.__heap)
+        return None
+
+    def run(self):
+        """Emit notifications until stop() is called."""
+        while True:
+            with self.__cond:
+                if self.__stopped:
+                    return
+                now = self.clock()
+                due = self.__pop_due(now)
+                if not due:
+                    self.__cond.wait(self.__timeout(now))
+                    continue
+            # The sink may be slow, the book is not blocked meanwhile
+            for when, name, birthday in due:
+                self.sink(when, name, birthday)
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.book.remove_listener(self.__changed)
+
+
+if __name__ == "__main__":
+    __usage_help_message = """
+    Usage:
+        python ./scheduler.py [--book=<file>] [--at=<HH:MM>] [--output=<file>]
+
+        --book=<file>:      Address book file, default is my_book.bin
+        --at=<HH:MM>:       Time of the notifications, default is 09:00
+        --output=<file>:    Append the notifications to the file instead of stdout
+        -h, --help:         Show this message
+
+    Example:
+        $python ./scheduler.py --at=08:30 --output=birthdays.log
+    """
+
+    options = {"book": "my_book.bin", "at": "09:00", "output": None}
+    cliargs.parse_args(sys.argv[1:], options, __usage_help_message)
+    try:
+        at = time.fromisoformat(options["at"])
+    except ValueError:
+        print("Error to parse args:", options["at"])
+        exit(1)
+    book = AddressBook(options["book"], journal=True)
+    sink = FileSink(options["output"]) if options["output"] else PrintSink()
+    scheduler = BirthdayScheduler(book, sink, at)
+    next_due = scheduler.next_due()
+    if next_due is not None:
+        print(f"{len(scheduler)} birthdays are scheduled, the next one is at {next_due[0]:%Y-%m-%d %H:%M}.")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,117 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+
+class NameIndex:
+    """Case-insensitive prefix and fuzzy search over contact names.
+
+    Prefixes are found by a binary search in the sorted array of folded names.
+    Fuzzy candidates are taken from the rarest trigrams of the query,
+    preselected by the length and the number of shared trigrams and then
+    checked with a bounded edit distance.
+    """
+
+    GRAM = 3
+    # The rarest trigrams give at most that many fuzzy candidates
+    MAX_CANDIDATES = 5000
+
+    def __init__(self, names=()):
+        self.__keys = []
+        self.__grams = defaultdict(set)
+        for name in names:
+            folded = name.casefold()
+            self.__keys.append((folded, name))
+            for gram in self.grams(folded):
+                self.__grams[gram].add(name)
+        self.__keys.sort()
+
+    @staticmethod
+    def grams(folded: str) -> set:
+        padded = f"\0{folded}\0"
+        return {
+            padded[i : i + NameIndex.GRAM]
+            for i in range(len(padded) - NameIndex.GRAM + 1)
+        }
+
+    def add(self, name: str):
+        folded = name.casefold()
+        insort(self.__keys, (folded, name))
+        for gram in self.grams(folded):
+            self.__grams[gram].add(name)
+
+    def remove(self, name: str):
+        folded = name.casefold()
+        i = bisect_left(self.__keys, (folded, name))
+        if i < len(self.__keys) and self.__keys[i] == (folded, name):
+            del self.__keys[i]
+        for gram in self.grams(folded):
+            names = self.__grams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.__grams[gram]
+
+    def prefix(self, query: str, limit: int) -> list:
+        query = query.casefold()
+        found = []
+        i = bisect_left(self.__keys, (query,))
+        while len(found) < limit and i < len(self.__keys):
+            folded, name = self.__keys[i]
+            if not folded.startswith(query):
+                break
+            found.append(name)
+            i += 1
+        return found
+
+    def fuzzy(self, query: str, max_distance: int, limit: int) -> list:
+        query = query.casefold()
+        postings = sorted(
+            (self.__grams.get(gram, ()) for gram in self.grams(query)), key=len
+        )
+        # Every edit breaks at most GRAM grams of the query, a name without
+        # shared grams is too far from it anyway
+        min_shared = max(1, len(postings) - max_distance * NameIndex.GRAM)
+        # A name with min_shared of the grams has one of the rarest ones
+        candidates = set()
+        for names in postings[: len(postings) - min_shared + 1]:
+            candidates.update(names)
+            if len(candidates) >= NameIndex.MAX_CANDIDATES:
+                break
+        found = []
+        for name in candidates:
+            folded = name.casefold()
+            if abs(len(folded) - len(query)) > max_distance:
+                continue
+            if sum(name in names for names in postings) < min_shared:
+                continue
+            distance = edit_distance(query, folded, max_distance)
+            if distance <= max_distance:
+                found.append((distance, name))
+        found.sort()
+        return [name for _, name in found[:limit]]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, or max_distance + 1 if it is bigger than max_distance.
+
+    Only the cells within max_distance of the diagonal are computed.
+    """
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+    previous = [min(j, too_far) for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        first = max(1, i - max_distance)
+        last = min(len(b), i + max_distance)
+        current = [too_far] * (len(b) + 1)
+        current[0] = min(i, too_far)
+        for j in range(first, last + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != b[j - 1]),
+            )
+        if min(current[first - 1 : last + 1]) > max_distance:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
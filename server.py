@@ -0,0 +1,209 @@
+import asyncio
+import json
+import sys
+from time import perf_counter
+
+import cliargs
+from addressbook import AddressBook, ErrorWithMsg
+from bot import Bot
+from metrics import Metrics
+
+
+class BookServer:
+    """Serves one shared address book to many clients over TCP or a Unix socket.
+
+    The protocol is line-oriented: a client sends commands of the bot, one per
+    line, and may send many of them without waiting for the answers. For each
+    command a JSON line with the result is sent back in the same order.
+    Commands are executed one by one in the event loop, so the book has a single
+    writer, and saving is left to the write-behind thread of the book.
+    """
+
+    CLOSE_CMDS = ("close", "exit", "q")
+    # Commands with a file name would read or write the files of the server
+    FILE_CMDS = ("import", "export-changes", "apply-changes")
+
+    def __init__(self, addressbook: AddressBook):
+        self.addressbook = addressbook
+        self.bot = Bot(addressbook)
+        self.server = None
+        self.requests = 0
+
+    def execute(self, line_number, line):
+        cmd, *args = line.split() or ("",)
+        cmd = cmd.lower()
+        self.requests += 1
+        if cmd in BookServer.CLOSE_CMDS:
+            # Only the connection is closed, not the shared book
+            result = "Good bye!"
+        elif cmd in BookServer.FILE_CMDS:
+            result = ErrorWithMsg(f"'{cmd}' is not allowed over the server.")
+        else:
+            result = self.bot.execute(cmd, args)
+        return self.bot.batch_result(line_number, cmd, result)
+
+    async def handle_client(self, reader, writer):
+        line_number = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line_number += 1
+                line = line.decode(errors="replace")
+                if not line.strip():
+                    continue
+                result = self.execute(line_number, line)
+                writer.write(json.dumps(result).encode() + b"\n")
+                # Returns at once until the output buffer is full
+                await writer.drain()
+                if result["cmd"] in BookServer.CLOSE_CMDS:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765, unix_path=None):
+        if unix_path:
+            self.server = await asyncio.start_unix_server(
+                self.handle_client, unix_path
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle_client, host, port
+            )
+        return self.server
+
+    async def serve_forever(self, host="127.0.0.1", port=8765, unix_path=None):
+        await self.start(host, port, unix_path)
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        self.addressbook.close()
+
+
+async def run_client(host, port, commands):
+    reader, writer = await asyncio.open_connection(host, port)
+    # All the commands are pipelined, then the answers are read
+    writer.write("".join(f"{cmd}\n" for cmd in commands).encode())
+    await writer.drain()
+    answers = [json.loads(await reader.readline()) for _ in commands]
+    writer.close()
+    await writer.wait_closed()
+    return answers
+
+
+async def run_benchmark(clients=200, requests=100, host="127.0.0.1", port=0):
+    """Start a server with an in-memory book and load it with concurrent clients."""
+    server = BookServer(AddressBook())
+    tcp_server = await server.start(host, port)
+    port = tcp_server.sockets[0].getsockname()[1]
+    jobs = []
+    for client in range(clients):
+        commands = [f"add client{client} {client:010d}"]
+        for i in range(requests - 1):
+            commands.append(
+                f"phone client{client}" if i % 2 else f"who {client:010d}"
+            )
+        jobs.append(run_client(host, port, commands))
+    start = perf_counter()
+    answers = await asyncio.gather(*jobs)
+    elapsed = perf_counter() - start
+    server.close()
+    failed = sum(not a["ok"] for client in answers for a in client)
+    total = clients * requests
+    print(
+        f"{clients} clients x {requests} requests: {total} requests "
+        f"in {elapsed:.2f} s, {total / elapsed:.0f} requests/s, {failed} failed"
+    )
+
+
+if __name__ == "__main__":
+    __usage_help_message = """
+    Usage:
+        python ./server.py [--host=<host>] [--port=<port>] [--unix=<path>] [--book=<file>]
+                           [--metrics=<file>] [--metrics-interval=<seconds>] [--notify=<file>]
+        python ./server.py --bench [--clients=<N>] [--requests=<N>]
+
+        --host, --port:     TCP address to listen on, default is 127.0.0.1:8765
+        --unix=<path>:      Listen on a Unix socket instead of TCP
+        --book=<file>:      Address book file, default is my_book.bin
+        --metrics=<file>:   Write the statistics of the 'stats' command to a JSON file
+                            periodically and at exit
+        --metrics-interval=<seconds>:
+                            How often the metrics file is written, default is 60
+        --notify=<file>:    Run the birthday scheduler, notifications are appended
+                            to the file ('-' is stdout)
+        --bench:            Run the benchmark with an in-memory book on localhost
+        --clients=<N>:      Number of concurrent benchmark clients, default is 200
+        --requests=<N>:     Number of pipelined requests per client, default is 100
+        -h, --help:         Show this message
+
+    Example:
+        $python ./server.py --port=9000
+        $printf 'add Bob 0123456789\\nphone Bob\\n' | nc 127.0.0.1 9000
+    """
+
+    options = {
+        "host": "127.0.0.1",
+        "port": "8765",
+        "unix": None,
+        "book": "my_book.bin",
+        "metrics": None,
+        "metrics-interval": "60",
+        "notify": None,
+        "clients": "200",
+        "requests": "100",
+        "bench": False,
+    }
+    cliargs.parse_args(
+        sys.argv[1:], options, __usage_help_message, flags={"bench": True}
+    )
+    try:
+        if options["bench"]:
+            asyncio.run(
+                run_benchmark(int(options["clients"]), int(options["requests"]))
+            )
+        else:
+            metrics = Metrics()
+            if options["metrics"]:
+                metrics.start_dump(
+                    options["metrics"], float(options["metrics-interval"])
+                )
+            server = BookServer(
+                AddressBook(
+                    options["book"],
+                    journal=True,
+                    write_behind=True,
+                    metrics=metrics,
+                )
+            )
+            scheduler = None
+            if options["notify"]:
+                from scheduler import BirthdayScheduler, PrintSink, FileSink
+
+                # Changes made by the clients are scheduled at once
+                scheduler = BirthdayScheduler(
+                    server.addressbook,
+                    PrintSink()
+                    if options["notify"] == "-"
+                    else FileSink(options["notify"]),
+                )
+                scheduler.start()
+            try:
+                asyncio.run(
+                    server.serve_forever(
+                        options["host"], int(options["port"]), options["unix"]
+                    )
+                )
+            finally:
+                if scheduler is not None:
+                    scheduler.stop()
+                server.close()
+                metrics.stop_dump()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,136 @@
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import gc
+import os
+import pickle
+import zlib
+
+
+class ShardedRecords(MutableMapping):
+    """Records of an address book split by name hash into shard files.
+
+    The book is a directory with a manifest (the number of shards) and
+    a pickle file per shard. Shards are loaded and written by a thread pool,
+    only the shards changed since the last save are rewritten.
+    """
+
+    SHARDS = 16
+    MANIFEST = "manifest"
+
+    def __init__(self, dirname: str, shards: int = None, workers: int = None):
+        self.dirname = dirname
+        manifest = os.path.join(dirname, self.MANIFEST)
+        if os.path.isfile(manifest):
+            # The number of shards of an existing book can not be changed
+            with open(manifest, "r") as fd:
+                shards = int(fd.read())
+        else:
+            shards = shards or self.SHARDS
+            os.makedirs(dirname, exist_ok=True)
+            with open(manifest, "w") as fd:
+                fd.write(str(shards))
+        self.__shards = [{} for _ in range(shards)]
+        self.__dirty = set()
+        self.workers = workers or min(shards, os.cpu_count() or 1)
+        self.load()
+
+    @property
+    def shards(self) -> int:
+        return len(self.__shards)
+
+    def shard_of(self, name: str) -> int:
+        # hash() of str differs between runs, crc32 does not
+        return zlib.crc32(name.encode()) % len(self.__shards)
+
+    def shard_filename(self, shard: int) -> str:
+        return os.path.join(self.dirname, f"shard-{shard:03d}.bin")
+
+    def __read_shard(self, shard):
+        filename = self.shard_filename(shard)
+        if not os.path.isfile(filename):
+            return {}
+        with open(filename, "rb") as fd:
+            return pickle.load(fd)
+
+    def __map(self, func, items) -> list:
+        with ThreadPoolExecutor(self.workers) as pool:
+            try:
+                results = pool.map(func, items)
+            except RuntimeError:
+                # No new threads at interpreter shutdown (the atexit close()),
+                # the shards are processed one by one then
+                return [func(item) for item in items]
+            return list(results)
+
+    def load(self):
+        # Unpickled records would be scanned by the collector again and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.__shards = self.__map(self.__read_shard, range(self.shards))
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.__dirty.clear()
+
+    def __getitem__(self, name):
+        return self.__shards[self.shard_of(name)][name]
+
+    def __setitem__(self, name, record):
+        shard = self.shard_of(name)
+        self.__shards[shard][name] = record
+        self.__dirty.add(shard)
+
+    def __delitem__(self, name):
+        shard = self.shard_of(name)
+        del self.__shards[shard][name]
+        self.__dirty.add(shard)
+
+    def __contains__(self, name):
+        return name in self.__shards[self.shard_of(name)]
+
+    def __iter__(self):
+        return chain.from_iterable(self.__shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.__shards)
+
+    def values(self):
+        return chain.from_iterable(shard.values() for shard in self.__shards)
+
+    def items(self):
+        return chain.from_iterable(shard.items() for shard in self.__shards)
+
+    def clear(self):
+        for shard in self.__shards:
+            shard.clear()
+        self.__dirty.update(range(self.shards))
+
+    def snapshot(self) -> list:
+        """Must be called under the book lock, the result is passed to write()."""
+        snapshot = [
+            (shard, pickle.dumps(self.__shards[shard]))
+            for shard in sorted(self.__dirty)
+        ]
+        self.__dirty.clear()
+        return snapshot
+
+    def __write_shard(self, item):
+        shard, chunk = item
+        filename = self.shard_filename(shard)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as fd:
+            fd.write(chunk)
+            # Must be on disk before the journal is truncated
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_filename, filename)
+
+    def write(self, snapshot: list):
+        try:
+            self.__map(self.__write_shard, snapshot)
+        except BaseException:
+            # Not written shards must be written by the next save
+            self.__dirty.update(shard for shard, _ in snapshot)
+            raise
@@ -0,0 +1,157 @@
+from collections.abc import MutableMapping
+from datetime import date
+from itertools import groupby
+import sqlite3
+import weakref
+
+from addressbook import Record
+
+
+class SqliteRecords(MutableMapping):
+    """Records of an address book stored in a SQLite database.
+
+    Records are loaded on access, so the book may be larger than RAM.
+    Changes are written immediately but committed only by commit().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            name TEXT PRIMARY KEY,
+            birthday INTEGER,
+            birthday_key INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS phones (
+            name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            number INTEGER NOT NULL,
+            PRIMARY KEY (name, position)
+        );
+        CREATE INDEX IF NOT EXISTS phones_number ON phones (number);
+        CREATE INDEX IF NOT EXISTS records_birthday_key
+            ON records (birthday_key);
+    """
+
+    def __init__(self, filename: str, book=None):
+        self.filename = filename
+        self.book = book
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        # The same record object must be returned while it is in use
+        self.__cache = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def birthday_key(month: int, day: int) -> int:
+        return month * 100 + day
+
+    def __make_record(self, name, birthday, phones):
+        record = self.__cache.get(name)
+        if record is None:
+            if birthday is not None:
+                birthday = date.fromordinal(birthday)
+            record = Record.from_values(name, phones, birthday)
+            record.attach(self.book)
+            self.__cache[name] = record
+        return record
+
+    def __getitem__(self, name):
+        record = self.__cache.get(name)
+        if record is not None:
+            return record
+        row = self.connection.execute(
+            "SELECT birthday FROM records WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        phones = self.connection.execute(
+            "SELECT number FROM phones WHERE name = ? ORDER BY position",
+            (name,),
+        )
+        return self.__make_record(name, row[0], (p for (p,) in phones))
+
+    def __setitem__(self, name, record):
+        birthday = record.birthday
+        if birthday is None:
+            row = (name, None, None)
+        else:
+            key = self.birthday_key(birthday.month, birthday.day)
+            row = (name, birthday.toordinal(), key)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?)", row
+        )
+        self.connection.execute("DELETE FROM phones WHERE name = ?", (name,))
+        self.connection.executemany(
+            "INSERT INTO phones VALUES (?, ?, ?)",
+            ((name, i, number) for i, number in enumerate(record.phones)),
+        )
+        self.__cache[name] = record
+
+    def __delitem__(self, name):
+        cursor = self.connection.execute(
+            "DELETE FROM records WHERE name = ?", (name,)
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(name)
+        self.connection.execute("DELETE FROM phones WHERE name = ?", (name,))
+        self.__cache.pop(name, None)
+
+    def __contains__(self, name):
+        row = self.connection.execute(
+            "SELECT 1 FROM records WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for (name,) in self.connection.execute("SELECT name FROM records"):
+            yield name
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM records"
+        ).fetchone()[0]
+
+    def values(self, offset: int = 0, limit: int = -1):
+        # One query for all records instead of one query per record
+        rows = self.connection.execute(
+            "SELECT records.name, birthday, number FROM ("
+            "  SELECT name, birthday FROM records"
+            "  ORDER BY name LIMIT ? OFFSET ?"
+            ") AS records "
+            "LEFT JOIN phones ON phones.name = records.name "
+            "ORDER BY records.name, position",
+            (limit, offset),
+        )
+        for name, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            phones = [row[2] for row in group if row[2] is not None]
+            yield self.__make_record(name, group[0][1], phones)
+
+    def clear(self):
+        self.connection.execute("DELETE FROM records")
+        self.connection.execute("DELETE FROM phones")
+        self.__cache.clear()
+
+    def names_by_phone(self, number: int) -> list:
+        rows = self.connection.execute(
+            "SELECT DISTINCT name FROM phones WHERE number = ? ORDER BY name",
+            (number,),
+        )
+        return [name for (name,) in rows]
+
+    def names_by_birthday(self, keys) -> list:
+        keys = [self.birthday_key(month, day) for month, day in keys]
+        rows = self.connection.execute(
+            "SELECT name FROM records WHERE birthday_key IN ({})".format(
+                ", ".join("?" * len(keys))
+            ),
+            keys,
+        )
+        return [name for (name,) in rows]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,23 @@
+import io
+
+from addressbook import AddressBook
+from bot import Bot
+
+
+def test_run_batch_flushes_after_executed_commands(tmp_path, monkeypatch):
+    book = AddressBook(str(tmp_path / "book.bin"))
+    flushes = []
+    dump_to_file = book.dump_to_file
+
+    def counting_dump():
+        flushes.append(len(book))
+        dump_to_file()
+
+    monkeypatch.setattr(book, "dump_to_file", counting_dump)
+    lines = ["# contacts", "", "add Ann 1111111111", "", "add Bob 2222222222",
+             "# more", "add Cid 3333333333", "add Dan 4444444444"]
+    output = io.StringIO()
+    Bot(book).run_batch(lines, flush_every=2, output=output)
+    assert len(output.getvalue().splitlines()) == 4
+    # After the 2nd and the 4th command, comments and blank lines are not counted
+    assert flushes[:2] == [2, 4]
@@ -0,0 +1,105 @@
+import pytest
+
+from addressbook import AddressBook, ErrorWithMsg, Record
+from changefeed import read_changes
+
+
+def make_book():
+    book = AddressBook()
+    book.add_record(Record("Ann", "1111111111"))
+    book.add_record(Record("Bob", "2222222222"))
+    return book
+
+
+def test_changes_are_coalesced_per_contact():
+    book = make_book()
+    position = book.feed.position
+    book["Ann"].add_phone("3333333333")
+    book["Ann"].add_birthday("01.02.2000")
+    book.delete("Bob")
+    full, rows, new_position = book.feed.changes(position)
+    assert not full
+    assert rows == [
+        {
+            "op": "put",
+            "name": "Ann",
+            "phones": ["1111111111", "3333333333"],
+            "birthday": "01.02.2000",
+        },
+        {"op": "del", "name": "Bob"},
+    ]
+    assert new_position == book.feed.position
+    assert book.feed.changes(new_position) == (False, [], new_position)
+
+
+def test_unknown_position_gives_a_full_copy():
+    book = make_book()
+    full, rows, _ = book.feed.changes("0")
+    assert full
+    assert rows[0] == {"op": "clear"}
+    assert [row["name"] for row in rows[1:]] == ["Ann", "Bob"]
+
+
+def test_replica_is_synced_by_export_and_apply(tmp_path):
+    source = make_book()
+    replica = AddressBook()
+    filename = str(tmp_path / "changes.jsonl")
+    full, count, position = source.feed.export("0", filename)
+    assert (full, count) == (True, 2)
+    replica.apply_changes(read_changes(filename)[1])
+    source["Bob"].add_phone("4444444444")
+    source.delete("Ann")
+    full, count, _ = source.feed.export(position, filename)
+    assert (full, count) == (False, 2)
+    replica.apply_changes(read_changes(filename)[1])
+    assert list(replica.data) == ["Bob"]
+    assert replica.find("Bob").get_phones() == ["2222222222", "4444444444"]
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        {"op": "del", "name": ["x"]},
+        {"op": "del"},
+        {"op": "put", "name": "Cid", "phones": ["12"]},
+        {"op": "rename", "name": "Cid"},
+    ],
+)
+def test_invalid_changes_change_nothing(row):
+    book = make_book()
+    with pytest.raises(ErrorWithMsg):
+        book.apply_changes([{"op": "del", "name": "Ann"}, row])
+    assert sorted(book.data) == ["Ann", "Bob"]
+
+
+def test_feed_is_continued_after_close(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Ann", "1111111111"))
+    book["Ann"].add_birthday("01.02.2000")
+    position = book.feed.position
+    book.add_record(Record("Bob", "2222222222"))
+    book.close()
+    book = AddressBook(filename, journal=True)
+    book.delete("Ann")
+    full, rows, _ = book.feed.changes(position)
+    assert not full
+    assert [(row["op"], row["name"]) for row in rows] == [
+        ("put", "Bob"),
+        ("del", "Ann"),
+    ]
+    full, rows, _ = book.feed.changes("0")
+    assert full
+
+
+def test_feed_is_new_after_a_crash(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Ann", "1111111111"))
+    book.close()
+    book = AddressBook(filename, journal=True)
+    position = book.feed.position
+    book.add_record(Record("Bob", "2222222222"))
+    # Not closed: the changes of this run are not in a saved feed
+    book = AddressBook(filename, journal=True)
+    assert book.feed.changes(position)[0]
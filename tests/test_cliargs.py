@@ -0,0 +1,40 @@
+import pytest
+
+import cliargs
+
+
+def test_values_flags_and_positional_arguments():
+    options = {"book": "my_book.bin", "every": None, "batch": False, "imports": None}
+    rest = cliargs.parse_args(
+        ["--book=x.jsonl", "cmds.txt", "--every=5", "--batch", "--imports"],
+        options,
+        "usage",
+        flags={"batch": True, "imports": "50"},
+        types={"every": int},
+        positional=True,
+    )
+    assert rest == ["cmds.txt"]
+    assert options == {"book": "x.jsonl", "every": 5, "batch": True, "imports": "50"}
+    cliargs.parse_args(["--imports=40"], options, "usage", flags={"imports": "50"})
+    assert options["imports"] == "40"
+
+
+@pytest.mark.parametrize(
+    "arg", ["--nope=1", "--book=", "--every=x", "--batch=1", "--book"]
+)
+def test_wrong_options_exit_with_an_error(arg, capsys):
+    options = {"book": "my_book.bin", "every": None, "batch": False}
+    with pytest.raises(SystemExit) as e:
+        cliargs.parse_args(
+            [arg], options, "usage", flags={"batch": True}, types={"every": int}
+        )
+    assert e.value.code == 1
+    assert capsys.readouterr().out == f"Error to parse args: {arg}\n"
+
+
+@pytest.mark.parametrize("args", [["-h"], ["--help"], ["file.txt"]])
+def test_help_and_positional_arguments_print_the_usage(args, capsys):
+    with pytest.raises(SystemExit) as e:
+        cliargs.parse_args(args, {}, "usage")
+    assert not e.value.code
+    assert capsys.readouterr().out == "usage\n"
@@ -0,0 +1,43 @@
+import os
+
+from addressbook import AddressBook, Record
+
+
+def test_journal_is_replayed(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Ann", "1111111111"))
+    book.add_record(Record("Bob", "2222222222"))
+    book["Ann"].add_birthday("01.02.2000")
+    book.delete("Bob")
+    book.close()
+    assert not os.path.exists(filename)
+    book = AddressBook(filename, journal=True)
+    assert list(book.data) == ["Ann"]
+    assert book.find("Ann").show_birthday() == "01.02.2000"
+
+
+def test_compaction_folds_the_journal(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = AddressBook(filename, journal=True, compact_threshold=10)
+    for i in range(25):
+        book.add_record(Record(f"N{i}", "1111111111"))
+    book.close()
+    assert os.path.exists(filename)
+    assert os.path.getsize(book.journal_filename) < 10 * 100
+    book = AddressBook(filename, journal=True)
+    assert len(book.data) == 25
+
+
+def test_changes_after_a_damaged_tail_are_kept(tmp_path):
+    filename = str(tmp_path / "book.bin")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Ann", "1111111111"))
+    book.close()
+    with open(book.journal_filename, "ab") as fd:
+        fd.write(b"\x80\x04garbage")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Bob", "2222222222"))
+    book.close()
+    book = AddressBook(filename, journal=True)
+    assert sorted(book.data) == ["Ann", "Bob"]
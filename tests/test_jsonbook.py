@@ -0,0 +1,37 @@
+import pytest
+
+import jsonbook
+from addressbook import Record
+
+
+def write_lines(tmp_path, *lines):
+    filename = tmp_path / "book.jsonl"
+    filename.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    return str(filename)
+
+
+def test_written_records_are_read_back(tmp_path):
+    filename = str(tmp_path / "book.jsonl")
+    record = Record("Ann Щ", "1111111111")
+    record.add_birthday("01.02.2000")
+    jsonbook.write(filename, jsonbook.snapshot([record, Record("Bob")]))
+    records = list(jsonbook.read(filename))
+    assert [str(r) for r in records] == [str(record), str(Record("Bob"))]
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ('{"name": "", "phones": [], "birthday": null}', "Name must not be empty"),
+        ('{"name": "Ann", "phones": ["12"], "birthday": null}', "Invalid phone"),
+        ('{"name": "Ann", "phones": [], "birthday": "30.02.2000"}', "Invalid birthday"),
+        ("[1, 2]", "invalid record"),
+        ('{"name": "Bob", "phones": [], "birthday": null}', "already exists"),
+    ],
+)
+def test_damaged_lines_are_reported(tmp_path, line, error):
+    filename = write_lines(
+        tmp_path, '{"name": "Bob", "phones": ["1111111111"], "birthday": null}', line
+    )
+    with pytest.raises(ValueError, match=f"line 2: .*{error}"):
+        list(jsonbook.read(filename))
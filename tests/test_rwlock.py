@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from rwlock import RWLock
+
+
+def test_locks_are_reentrant():
+    lock = RWLock()
+    with lock:
+        with lock:
+            # The writer may read as well
+            with lock.reader:
+                pass
+    with lock.reader:
+        with lock.reader:
+            pass
+    # Released completely: another thread gets the write lock
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (lock.acquire_write(), done.set()))
+    thread.start()
+    thread.join(1)
+    assert done.is_set()
+
+
+def test_reader_can_not_be_upgraded():
+    lock = RWLock()
+    with lock.reader:
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    with lock:
+        pass
+
+
+def test_readers_share_the_lock():
+    lock = RWLock()
+    inside = threading.Barrier(2, timeout=1)
+
+    def read():
+        with lock.reader:
+            # Both readers must be inside at the same time
+            inside.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not inside.broken
+
+
+def test_waiting_writer_goes_first():
+    lock = RWLock()
+    order = []
+
+    def write():
+        with lock:
+            order.append("writer")
+
+    def read():
+        with lock.reader:
+            order.append("reader")
+
+    lock.acquire_read()
+    writer = threading.Thread(target=write)
+    writer.start()
+    # Let the writer wait for the lock
+    time.sleep(0.1)
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.1)
+    assert order == []
+    lock.release_read()
+    writer.join(1)
+    reader.join(1)
+    assert order == ["writer", "reader"]
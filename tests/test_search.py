@@ -0,0 +1,31 @@
+from addressbook import AddressBook, Record
+from search import NameIndex, edit_distance
+
+
+def test_edit_distance_is_bounded():
+    assert edit_distance("olena", "olena", 2) == 0
+    assert edit_distance("olena", "olna", 2) == 1
+    assert edit_distance("olena", "elena", 2) == 1
+    assert edit_distance("olena", "alina", 2) == 2
+    assert edit_distance("olena", "taras", 2) == 3
+    assert edit_distance("olena", "ol", 2) == 3
+
+
+def test_prefix_and_fuzzy():
+    index = NameIndex(["Olena", "Oleh", "Olga", "Taras", "Elena"])
+    assert index.prefix("ol", 10) == ["Oleh", "Olena", "Olga"]
+    assert index.fuzzy("Olna", 1, 10) == ["Olena", "Olga"]
+    assert index.fuzzy("olena", 1, 10) == ["Olena", "Elena"]
+    assert index.fuzzy("xyz", 2, 10) == []
+    index.remove("Elena")
+    index.add("Alena")
+    assert index.fuzzy("olena", 1, 10) == ["Olena", "Alena"]
+
+
+def test_book_search_follows_changes():
+    book = AddressBook(concurrent=True)
+    book.add_record(Record("Olena", "1111111111"))
+    assert book.search("Olna") == ["Olena"]
+    book.add_record(Record("Oleh", "2222222222"))
+    book.delete("Olena")
+    assert book.search("Ole") == ["Oleh"]
@@ -0,0 +1,41 @@
+import shardedbook
+from addressbook import AddressBook, Record
+
+
+def test_record_edits_are_saved(tmp_path):
+    filename = str(tmp_path / "book.shards")
+    book = AddressBook(filename)
+    book.add_record(Record("Bob", "1111111111"))
+    book["Bob"].add_phone("2222222222")
+    book["Bob"].add_birthday("01.01.1990")
+    book.close()
+    record = AddressBook(filename).find("Bob")
+    assert record.get_phones() == ["1111111111", "2222222222"]
+    assert record.show_birthday() == "01.01.1990"
+
+
+def test_record_edits_survive_compaction(tmp_path):
+    filename = str(tmp_path / "book.shards")
+    book = AddressBook(filename, journal=True)
+    book.add_record(Record("Bob", "1111111111"))
+    book.compact()
+    book["Bob"].add_phone("2222222222")
+    book.compact()
+    book.close()
+    record = AddressBook(filename, journal=True).find("Bob")
+    assert record.get_phones() == ["1111111111", "2222222222"]
+
+
+def test_shards_are_written_without_the_pool(tmp_path, monkeypatch):
+    class ShutdownPool(shardedbook.ThreadPoolExecutor):
+        # As at interpreter shutdown, when atexit calls close()
+        def submit(self, *args, **kwargs):
+            raise RuntimeError("cannot schedule new futures")
+
+    filename = str(tmp_path / "book.shards")
+    book = AddressBook(filename)
+    monkeypatch.setattr(shardedbook, "ThreadPoolExecutor", ShutdownPool)
+    book.add_record(Record("Bob", "1111111111"))
+    book.close()
+    monkeypatch.undo()
+    assert AddressBook(filename).find("Bob").get_phone() == "1111111111"
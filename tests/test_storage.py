@@ -0,0 +1,68 @@
+import pytest
+
+from addressbook import AddressBook, Record
+
+FORMATS = ("book.bin", "book.jsonl", "book.sqlite", "book.ibin", "book.shards")
+
+
+def fill(book):
+    book.add_record(Record("Ann", "1111111111"))
+    book.add_record(Record("Bob", "2222222222"))
+    book.add_record(Record("Cid", "3333333333"))
+    book["Ann"].add_phone("4444444444")
+    book["Bob"].add_birthday("29.02.2000")
+    book.delete("Cid")
+
+
+def check(book):
+    assert sorted(book.data) == ["Ann", "Bob"]
+    assert book.find("Ann").get_phones() == ["1111111111", "4444444444"]
+    assert book.find("Bob").show_birthday() == "29.02.2000"
+    assert book.find_by_phone("4444444444") == ["Ann"]
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_round_trip(tmp_path, name):
+    filename = str(tmp_path / name)
+    book = AddressBook(filename)
+    fill(book)
+    book.close()
+    check(AddressBook(filename))
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_round_trip_with_journal_and_write_behind(tmp_path, name):
+    filename = str(tmp_path / name)
+    book = AddressBook(filename, journal=True, write_behind=True)
+    fill(book)
+    book.close()
+    check(AddressBook(filename, journal=True))
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_write_and_load_from_file(tmp_path, name):
+    filename = str(tmp_path / name)
+    book = AddressBook(filename)
+    book.defer_saving()
+    fill(book)
+    book.write_to_file()
+    book.load_from_file()
+    check(book)
+    check(AddressBook(filename))
+
+
+@pytest.mark.parametrize(
+    "filename, storage",
+    [
+        ("book.bin", "pickle"),
+        ("book", "pickle"),
+        ("book.json", "json"),
+        ("book.jsonl", "json"),
+        ("book.sqlite", "sqlite"),
+        ("book.db", "sqlite"),
+        ("book.ibin", "indexed"),
+        ("book.shards", "sharded"),
+    ],
+)
+def test_storage_format_is_chosen_by_extension(filename, storage):
+    assert AddressBook.storage_format(filename) == storage